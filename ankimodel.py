@@ -0,0 +1,73 @@
+from __future__ import annotations
+from typing import List
+
+import genanki
+
+from manifest import stableId
+
+
+class MyModel(genanki.Model):
+  """
+  Customize how all Anki Notes will look like in this Anki Model.
+
+  Also, create a hash for this Model, for Anki app to track future Notes update.
+  """
+  DefaultFrontTemplate = '''
+  <div class="front">{{TableOfContent}}<br><br>{{Question}}</div>
+  '''
+
+  DefaultBackTemplate = '''
+  <div class="back">
+  <table style="width:100%">
+    <tr>
+      <th>{{TableOfContent}}</th>
+    </tr>
+    <tr>
+      <th>{{Answer}}</th>
+    </tr>
+    <tr>
+      <th>{{Media}}</th>
+    </tr>
+  </table>
+  </div>
+
+  </div>
+  '''
+
+  DefaultStyle = '''
+  .card {
+    font-family: 'DejaVu Sans Mono';
+    text-align: left;
+    color: white;
+    background-color: rgba(42, 129, 151,1);
+    text-shadow: 0px 4px 3px rgba(0,0,0,0.4),
+                0px 8px 13px rgba(0,0,0,0.1),
+                0px 18px 23px rgba(0,0,0,0.1);
+  }
+
+  .front {
+    font-size: 20px;
+  }
+
+  .back {
+    font-size: 20px;
+  }
+
+  th {
+      height:200px
+      width:auto;/*maintain aspect ratio*/
+      max-width:500px;
+  }
+
+  @font-face { font-family: DejaVu Sans Mono; src: url('_DejaVuSansMono.ttf'); }
+  '''
+  
+  def __init__(self, name: str, fields: List, front_html=DefaultFrontTemplate, back_html=DefaultBackTemplate, css= DefaultStyle):
+    hex_dig = stableId(name)
+    
+    templates = [{
+        'name': 'Card 1',
+        'qfmt': front_html,
+        'afmt': back_html,
+      }]
+    super(MyModel, self).__init__(model_id=hex_dig, name=name, fields=fields, templates=templates, css=css)
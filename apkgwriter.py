@@ -0,0 +1,174 @@
+from __future__ import annotations
+import itertools, json, os, sqlite3, tempfile, time, zipfile
+from typing import Dict, List, Tuple
+
+import genanki
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+
+from mediastore import MediaStore
+
+
+class ApkgWriter:
+  """
+  Write an .apkg while the notes are still being created, instead of keeping the whole deck in memory
+
+  The collection database is created when the writer opens. Notes and cards are inserted in batches,
+  all inside 1 transaction, and each media file goes into the zip as soon as it is added.
+  close() writes the decks and models, then puts the database into the zip.
+
+  The result is the same as genanki.Package.write_to_file() with the same timestamp: same rows, same ids.
+
+  file can be a filename or a binary file object, like io.BytesIO. With inMemory, the database is never
+  written to disk either ( Python 3.11+, older versions still use a temporary file ).
+  A filename is written as filename.tmp, and only replaces filename after close(), so an error while the notes
+  are created keeps the old .apkg.
+
+  Example:
+  ```python
+  with ApkgWriter('Document.docx.apkg') as output:
+    output.addDeck(my_deck)
+    output.addMedia('image1.png', binary)
+    for note in notes:
+      output.addNote(note, my_deck)
+  ```
+  """
+  def __init__(self, file, timestamp: float = None, batchSize: int = 1000, inMemory: bool = False):
+    self.timestamp = time.time() if timestamp is None else timestamp
+    self.batchSize = batchSize
+    self.idGen = itertools.count(int(self.timestamp * 1000))
+    self.decks: Dict[int, genanki.Deck] = {}
+    # model id -> (model, id of the last deck using it), same as genanki Deck.write_to_db()
+    self.models: Dict[int, Tuple[genanki.Model, int]] = {}
+    self.mediaNames: List[str] = []
+    self.noteCount = 0
+    self.cardCount = 0
+    self._noteRows, self._cardRows = [], []
+
+    self.dbfilename = None
+    if inMemory and hasattr(sqlite3.Connection, 'serialize'):
+      self.conn = sqlite3.connect(':memory:')
+    else:
+      dbfile, self.dbfilename = tempfile.mkstemp()
+      os.close(dbfile)
+      self.conn = sqlite3.connect(self.dbfilename)
+    self.conn.executescript(APKG_SCHEMA)
+    self.conn.executescript(APKG_COL)
+    self.conn.execute('BEGIN')
+    self.filename = None
+    if isinstance(file, (str, os.PathLike)):
+      self.filename = os.fspath(file)
+      file = self.filename + '.tmp'
+    self.zipFile = zipfile.ZipFile(file, 'w')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, excValue, tb):
+    if excType is None:
+      self.close()
+    else:
+      self.abort()
+
+  def addDeck(self, deck: genanki.Deck):
+    if not isinstance(deck.deck_id, int):
+      raise TypeError('Deck .deck_id must be an integer, not {}.'.format(deck.deck_id))
+    if not isinstance(deck.name, str):
+      raise TypeError('Deck .name must be a string, not {}.'.format(deck.name))
+    self.decks[deck.deck_id] = deck
+
+  def addNote(self, note: genanki.Note, deck: genanki.Deck):
+    """
+    Add 1 note and its cards into deck. The deck must be added with addDeck() first
+    """
+    note._check_number_model_fields_matches_num_fields()
+    note._check_invalid_html_tags_in_fields()
+    self.models[note.model.model_id] = (note.model, deck.deck_id)
+
+    noteId = next(self.idGen)
+    self._noteRows.append((noteId, note.guid, note.model.model_id, int(self.timestamp), -1,
+                           note._format_tags(), note._format_fields(), note.sort_field, 0, 0, ''))
+    for card in note.cards:
+      self._cardRows.append((next(self.idGen), noteId, deck.deck_id, card.ord, int(self.timestamp), -1,
+                             0, -1 if card.suspend else 0, note.due, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+    self.noteCount += 1
+    if len(self._noteRows) >= self.batchSize:
+      self._flush()
+
+  def addMedia(self, name: str, binary: bytes):
+    """
+    Media files are numbered in the zip, the real names go into the 'media' file at close()
+    """
+    self.zipFile.writestr(str(len(self.mediaNames)), binary)
+    self.mediaNames.append(name)
+
+  def _flush(self):
+    self.conn.executemany('INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?);', self._noteRows)
+    self.conn.executemany('INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);', self._cardRows)
+    self.cardCount += len(self._cardRows)
+    self._noteRows, self._cardRows = [], []
+
+  def close(self):
+    """
+    Write the decks and models, then finish the .apkg
+    """
+    try:
+      self._flush()
+      cursor = self.conn.cursor()
+      decksJson, modelsJson = cursor.execute('SELECT decks, models FROM col').fetchone()
+      decks, models = json.loads(decksJson), json.loads(modelsJson)
+      decks.update({str(deckId): deck.to_json() for deckId, deck in self.decks.items()})
+      models.update({str(modelId): model.to_json(self.timestamp, deckId) for modelId, (model, deckId) in self.models.items()})
+      cursor.execute('UPDATE col SET decks = ?, models = ?', (json.dumps(decks), json.dumps(models)))
+      self.conn.commit()
+
+      if self.dbfilename:
+        self.conn.close()
+        self.zipFile.write(self.dbfilename, 'collection.anki2')
+      else:
+        self.zipFile.writestr('collection.anki2', self.conn.serialize())
+        self.conn.close()
+      self.zipFile.writestr('media', json.dumps(dict(enumerate(self.mediaNames))))
+      self.zipFile.close()
+      if self.filename:
+        os.replace(self.filename + '.tmp', self.filename)
+    finally:
+      if self.dbfilename:
+        os.remove(self.dbfilename)
+
+  def abort(self):
+    """
+    Stop writing, after an error. A filename is left as it was, a file object is left incomplete
+    """
+    self.conn.close()
+    self.zipFile.close()
+    if self.filename:
+      os.remove(self.filename + '.tmp')
+    if self.dbfilename:
+      os.remove(self.dbfilename)
+
+
+class MediaPackage(genanki.Package):
+  """
+  genanki.Package, but the media files come from a MediaStore instead of files on disk
+
+  Example:
+  ```python
+  MediaPackage(my_deck, media).write_to_file('Document.docx.apkg')
+  ```
+  """
+  def __init__(self, deck_or_decks=None, media: MediaStore = None):
+    super(MediaPackage, self).__init__(deck_or_decks)
+    self.media = media or MediaStore()
+
+  def write_to_file(self, file, timestamp: float = None):
+    """
+    Same as genanki.Package.write_to_file(), except how media is added into the zip
+    """
+    with ApkgWriter(file, timestamp) as output:
+      for name, binary in self.media:
+        output.addMedia(name, binary)
+      for deck in self.decks:
+        output.addDeck(deck)
+        for note in deck.notes:
+          output.addNote(note, deck)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+import argparse, glob, os, re, sys, traceback
+from typing import TYPE_CHECKING, Dict, List
+
+from myanki import docxToAnkiDeck
+from mediastore import MediaStore
+
+if TYPE_CHECKING:
+  import genanki
+
+
+class BatchResult:
+  """
+  What happened to 1 .docx file in a batch
+
+  error is empty when the conversion worked, otherwise it has the traceback from the worker
+  """
+  def __init__(self, filename: str, output: str = '', noteCount: int = 0, error: str = ''):
+    self.filename = filename
+    self.output = output
+    self.noteCount = noteCount
+    self.error = error
+
+  def __repr__(self):
+    if self.error:
+      return 'FAILED ' + self.filename + os.linesep + self.error
+    return 'OK     ' + self.filename + ' -> ' + self.output + ' (' + str(self.noteCount) + ' notes)'
+
+
+def findDocxFiles(source: str) -> List[str]:
+  """
+  Find all .docx files from a directory ( recursively ), or a glob pattern
+
+  Word keeps a hidden ~$Document.docx lock file next to an opened document, those are skipped.
+
+  Example:
+  findDocxFiles('notes')
+  >>> ['notes/a.docx', 'notes/python/b.docx']
+  findDocxFiles('notes/*/*.docx')
+  >>> ['notes/python/b.docx']
+  """
+  if os.path.isdir(source):
+    source = os.path.join(source, '**', '*.docx')
+  files = glob.glob(source, recursive=True)
+  return sorted(f for f in files if os.path.isfile(f) and not os.path.basename(f).startswith('~$'))
+
+
+def sourceRoot(source: str) -> str:
+  """
+  The folder the namespaces of the files found from source are relative to, check findDocxFiles():
+  the directory itself, the folder before the first wildcard of a glob pattern, or the folder of a file
+
+  Example:
+  sourceRoot('notes/*/*.docx')
+  >>> 'notes'
+  """
+  if os.path.isdir(source):
+    return source
+  root = os.path.dirname(source)
+  while glob.has_magic(root):
+    root = os.path.dirname(root)
+  return root
+
+
+def documentNamespace(filename: str, root: str) -> str:
+  """
+  The namespace of 1 document, its path from root with / on every OS, check myanki.iterDocxNotes().
+  notes/a/x.docx and notes/b/x.docx get a/x.docx and b/x.docx, so they never share deck ids or note guids
+  """
+  return os.path.relpath(filename, root or os.curdir).replace(os.sep, '/')
+
+
+def _convertToFile(filename: str, namespace: str = None) -> BatchResult:
+  """
+  Worker: convert 1 .docx into its own .apkg next to it
+
+  Images are kept in memory, so workers never share any scratch file.
+  """
+  from apkgwriter import MediaPackage
+  try:
+    deck, media = docxToAnkiDeck(filename, namespace=namespace)
+    MediaPackage(deck, media).write_to_file(filename+'.apkg')
+    return BatchResult(filename, filename+'.apkg', len(deck.notes))
+  except Exception:
+    return BatchResult(filename, error=traceback.format_exc())
+
+
+def _convertToDeck(filename: str, namespace: str = None):
+  """
+  Worker: convert 1 .docx into a deck, and send the deck and the image binaries back to the main process.
+  The main process merges them into 1 .apkg
+  """
+  try:
+    deck, media = docxToAnkiDeck(filename, namespace=namespace)
+    return BatchResult(filename, noteCount=len(deck.notes)), deck, media.files
+  except Exception:
+    return BatchResult(filename, error=traceback.format_exc()), None, {}
+
+
+def _renameMedia(deck: genanki.Deck, renames: Dict[str, str]):
+  """
+  Point all the <img src> inside a deck to their new names, all at once.
+  Media is the 3rd field, check MyModel
+  """
+  def rename(match):
+    return '<img src="' + renames.get(match.group(1), match.group(1)) + '">'
+  for n in deck.notes:
+    n.fields[2] = re.sub('<img src="([^"]*)">', rename, n.fields[2])
+
+
+def convertDocxFiles(filenames: List[str], workers: int = None, mergedOutput: str = None,
+                     namespaces: Dict[str, str] = None) -> List[BatchResult]:
+  """
+  Convert many .docx files at the same time, with a pool of worker processes
+
+  :workers:: how many processes, default is number of CPUs
+  :mergedOutput:: if given, all documents go into this 1 .apkg ( 1 deck per document ).
+  Otherwise, each document gets its own .apkg next to it
+  :namespaces:: { filename: namespace }, check documentNamespace(). Default is the file name without its folder.
+  In a merged .apkg, a document with the same deck id or a note guid as another one fails, instead of
+  mixing its notes with the other one's
+
+  A failed document does not stop the batch, check BatchResult.error for each file.
+  Results are in the same order as filenames.
+  """
+  from concurrent.futures import ProcessPoolExecutor, as_completed
+  results: Dict[str, BatchResult] = {}
+  decks, media = [], MediaStore()
+  # deck id / note guid -> the file it comes from
+  deckIds: Dict[int, str] = {}
+  guids: Dict[str, str] = {}
+  namespaces = namespaces or {}
+  # filename -> ( deck, media ) of the documents to merge
+  converted = {}
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    worker = _convertToDeck if mergedOutput else _convertToFile
+    futures = {pool.submit(worker, f, namespaces.get(f)): f for f in filenames}
+    for future in as_completed(futures):
+      filename = futures[future]
+      try:
+        outcome = future.result()
+      except Exception:
+        # the worker process itself died, or the result cannot be sent back
+        results[filename] = BatchResult(filename, error=traceback.format_exc())
+        continue
+
+      if not mergedOutput:
+        results[filename] = outcome
+        continue
+
+      result, deck, deckMedia = outcome
+      results[filename] = result
+      if not result.error:
+        converted[filename] = (deck, deckMedia)
+
+  # merged in the order of filenames, so the same document always wins a clash
+  for filename in filenames:
+    if filename not in converted:
+      continue
+    deck, deckMedia = converted.pop(filename)
+    clash = deckIds.get(deck.deck_id) or next((guids[n.guid] for n in deck.notes if n.guid in guids), None)
+    if clash:
+      results[filename].error = 'Same deck id or note guids as ' + clash + ', their notes would overwrite each other ' \
+                                'in Anki. Give them different namespaces' + os.linesep
+      continue
+    deckIds[deck.deck_id] = filename
+    guids.update((n.guid, filename) for n in deck.notes)
+    # Every document has its own image1.png, image2.png ..., the ones that clash get a new name
+    renames = {}
+    for name, binary in deckMedia.items():
+      newName = media.add(name, binary)
+      if newName != name:
+        renames[name] = newName
+    if renames:
+      _renameMedia(deck, renames)
+    decks.append(deck)
+
+  if mergedOutput and decks:
+    from apkgwriter import MediaPackage
+    MediaPackage(decks, media).write_to_file(mergedOutput)
+    for r in results.values():
+      if not r.error:
+        r.output = mergedOutput
+
+  return [results[f] for f in filenames]
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Convert many .docx files into Anki .apkg files')
+  parser.add_argument('sources', nargs='+', help='.docx files, directories, or glob patterns like "notes/*.docx"')
+  parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes, default is number of CPUs')
+  parser.add_argument('-o', '--merge', metavar='OUTPUT.apkg', default=None, help='write 1 merged .apkg instead of 1 .apkg per file')
+  args = parser.parse_args()
+
+  filenames, namespaces = [], {}
+  for s in args.sources:
+    for f in findDocxFiles(s):
+      if f not in namespaces:
+        filenames.append(f)
+        namespaces[f] = documentNamespace(f, sourceRoot(s))
+  if not filenames:
+    print('No .docx file found')
+    sys.exit(1)
+
+  batchResults = convertDocxFiles(filenames, args.workers, args.merge, namespaces)
+  for r in batchResults:
+    print(r)
+  failed = [r for r in batchResults if r.error]
+  print(len(batchResults) - len(failed), 'converted,', len(failed), 'failed')
+  sys.exit(1 if failed else 0)
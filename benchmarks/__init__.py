@@ -0,0 +1,9 @@
+"""
+Scripts to measure docx -> Anki conversion on big generated documents
+
+Run from the repository root, for example:
+python3 -m benchmarks.stages --paragraphs 100 1000 10000 100000 -o results.json
+python3 -m benchmarks.memory --paragraphs 50000
+python3 -m benchmarks.sphinxpage --page python-docs/library/stdtypes.html
+python3 -m benchmarks.importtime   # exit 1 if an entry point is over its import time budget
+"""
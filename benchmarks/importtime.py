@@ -0,0 +1,59 @@
+from __future__ import annotations
+import argparse, json, subprocess, sys
+
+# entry point -> ( import time budget in ms, modules it must not import )
+# genanki, python-docx, PIL, lxml, sqlite3, cProfile and zipfile are imported by the stage that needs them,
+# never at startup. The budgets are about 3x the time on an idle machine, so a busy one does not fail the check
+HEAVY = ('docx', 'genanki', 'PIL', 'lxml', 'sqlite3', 'cProfile', 'pstats', 'zipfile')
+BUDGETS = {
+  'myanki': (150, HEAVY),
+  'htmlToAnki': (100, HEAVY),
+  'batch': (180, HEAVY),
+  'watch': (180, HEAVY),
+  'service': (300, HEAVY),
+}
+
+
+def importMs(module: str) -> float:
+  """
+  Cumulative import time of module, from python -X importtime in a fresh process
+  """
+  stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          check=True, capture_output=True, text=True).stderr
+  for line in reversed(stderr.splitlines()):
+    fields = [f.strip() for f in line.split('|')]
+    if len(fields) == 3 and fields[2] == module:
+      return int(fields[1]) / 1000
+  raise ValueError('no import time for ' + module)
+
+
+def importedModules(module: str, candidates) -> list:
+  """
+  Which of candidates are in sys.modules after importing module
+  """
+  code = 'import sys, %s; print(" ".join(m for m in %r if m in sys.modules))' % (module, tuple(candidates))
+  return subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout.split()
+
+
+def check(repeat: int = 5, scale: float = 1.0) -> dict:
+  """
+  @return { module: { ms ( best of repeat ), budgetMs, heavyImports, ok } }
+  """
+  results = {}
+  for module, (budget, forbidden) in BUDGETS.items():
+    ms = min(importMs(module) for _ in range(repeat))
+    heavy = importedModules(module, forbidden)
+    results[module] = {'ms': round(ms, 1), 'budgetMs': budget * scale, 'heavyImports': heavy,
+                       'ok': ms <= budget * scale and not heavy}
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Check the import time of each entry point against its budget, exit 1 if one is over')
+  parser.add_argument('--repeat', type=int, default=5, help='best of this many fresh processes')
+  parser.add_argument('--scale', type=float, default=1.0, help='multiply all budgets, for slower machines')
+  args = parser.parse_args()
+
+  results = check(args.repeat, args.scale)
+  print(json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2))
+  sys.exit(0 if all(r['ok'] for r in results.values()) else 1)
@@ -0,0 +1,128 @@
+from __future__ import annotations
+import argparse, ctypes, gc, json, os, subprocess, sys, tempfile
+
+from benchmarks.synthetic import makeDocx
+from profiling import peakKB
+
+
+def _rssKB() -> int:
+  """
+  Current resident memory of this process, in KB. Only on Linux, 0 elsewhere
+  """
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+  except OSError:
+    return 0
+
+
+def _freeMemory():
+  """
+  Collect garbage, then ask glibc to give the freed memory back, so the next RSS reading only counts live objects
+  """
+  gc.collect()
+  try:
+    ctypes.CDLL('libc.so.6').malloc_trim(0)
+  except (OSError, AttributeError):
+    pass
+
+
+class _DictNode:
+  """
+  The Node before __slots__ and ParagraphRecord: attributes in a __dict__, and the python-docx Paragraphs
+  as context, which keep the whole document xml alive
+  """
+  def __init__(self, parent, context):
+    self.context = context
+    self.parent = parent
+    self.level = 0 if parent is None else parent.level + 1
+    self.children = []
+
+
+def _dictTree(root, paragraphs) -> _DictNode:
+  """
+  The same tree as root, with _DictNode and the python-docx Paragraph of each ParagraphRecord.
+  Records are in document order in a pre-order walk, so each is found by going forward in paragraphs
+  """
+  remaining = iter(paragraphs)
+
+  def find(record):
+    for p in remaining:
+      if p.text == record.text:
+        return p
+    raise ValueError('no paragraph for ' + repr(record.text[:20]))
+
+  newRoot = _DictNode(None, [])
+  stack = [(c, newRoot) for c in reversed(root.children)]
+  while stack:
+    n, parent = stack.pop()
+    copy = _DictNode(parent, [find(r) for r in n.context])
+    parent.children.append(copy)
+    stack.extend((c, copy) for c in reversed(n.children))
+  return newRoot
+
+
+def measure(filename: str, layout: str) -> dict:
+  """
+  Memory of the Node tree of 1 document, in 1 of the 2 layouts. Runs in its own process.
+
+  - dict: the old layout, _DictNode holding python-docx Paragraphs, so the document xml stays alive
+  - slots: Node with __slots__ holding ParagraphRecord, the python-docx objects are freed
+
+  treeKB is the resident memory after the tree is built and everything else is freed, minus the memory before
+  """
+  from docx.package import Package
+  from docx2tree import convertParagraphsToTree
+  from codeblocks import CodeBlockIndex
+  from mediastore import MediaStore
+
+  _freeMemory()
+  result = {'layout': layout, 'startKB': _rssKB()}
+  package = Package.open(filename)
+  root = convertParagraphsToTree(package, MediaStore(), CodeBlockIndex())
+  if layout == 'dict':
+    root = _dictTree(root, package.main_document_part.document.paragraphs)
+  del package
+  _freeMemory()
+  result['afterTreeKB'] = _rssKB()
+  result['treeKB'] = result['afterTreeKB'] - result['startKB']
+
+  nodes, stack = 0, [root]
+  while stack:
+    nodes += 1
+    stack += stack.pop().children
+  result['nodes'] = nodes
+  result['peakKB'] = peakKB()
+  return result
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Memory of the Node tree, in the old layout ( __dict__ nodes with python-docx Paragraphs ) and with __slots__ and ParagraphRecord')
+  parser.add_argument('filename', nargs='?', help='a .docx file, default is a generated one')
+  parser.add_argument('--paragraphs', type=int, default=20000, help='size of the generated document')
+  parser.add_argument('--child', choices=['dict', 'slots'], help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    print(json.dumps(measure(args.filename, args.child)))
+    sys.exit(0)
+
+  filename = args.filename
+  if not filename:
+    fd, filename = tempfile.mkstemp(suffix='.docx')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(makeDocx(args.paragraphs))
+
+  try:
+    # each layout in a fresh process, so the memory of one does not hide the other
+    results = {}
+    for layout in ('dict', 'slots'):
+      output = subprocess.run([sys.executable, '-m', 'benchmarks.memory', filename, '--child', layout],
+                              check=True, capture_output=True, text=True).stdout
+      results[layout] = json.loads(output)
+    saved = results['dict']['treeKB'] - results['slots']['treeKB']
+    print(json.dumps({'python': sys.version.split()[0], 'results': results, 'savedKB': saved,
+                      'savedPercent': round(100 * saved / max(results['dict']['treeKB'], 1), 1)}, indent=2))
+  finally:
+    if not args.filename:
+      os.remove(filename)
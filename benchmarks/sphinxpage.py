@@ -0,0 +1,130 @@
+from __future__ import annotations
+import argparse, io, json, os, random, sys, time
+import xml.etree.ElementTree as ET
+from typing import List
+
+import htmlToAnki
+
+
+def _paragraph(rnd: random.Random) -> str:
+  return '<p>Some <code class="docutils literal notranslate"><span class="pre">text</span></code> and a ' \
+         '<a class="reference internal" href="#x">link</a> %d.</p>\n' % rnd.randint(0, 999)
+
+
+def _content(rnd: random.Random, ident: str, blocks: int) -> List[str]:
+  """
+  The body of 1 section: text, code, api entries and admonitions, like a library reference page
+  """
+  parts = []
+  for i in range(blocks):
+    k = rnd.random()
+    if k < 0.45:
+      parts.append(_paragraph(rnd))
+    elif k < 0.55:
+      parts.append('<ul class="simple">\n<li><p>item</p></li>\n<li><p>other item</p></li>\n</ul>\n')
+    elif k < 0.65:
+      parts.append('<div class="highlight-python3 notranslate"><div class="highlight"><pre><span></span>'
+                   '<span class="kn">import</span> json\n</pre></div>\n</div>\n')
+    elif k < 0.8:
+      parts.append('<dl class="py function">\n<dt class="sig sig-object py" id="%s.f%d">\n<span class="sig-name">f</span>'
+                   '</dt>\n<dd>%s</dd>\n</dl>\n' % (ident, i, _paragraph(rnd)))
+    elif k < 0.85:
+      parts.append('<div class="admonition note">\n<p class="admonition-title">Note</p>\n%s</div>\n' % _paragraph(rnd))
+    elif k < 0.9:
+      parts.append('<dl class="py method" id="%s.m%d"><dt>m</dt><dd>%s</dd></dl>\n' % (ident, i, _paragraph(rnd)))
+    else:
+      parts.append('<div class="other"><span>in a div</span>%s<div><p>deeper</p></div></div>\n' % _paragraph(rnd))
+  return parts
+
+
+def makePage(sections: int = 2000, depth: int = 6, seed: int = 0) -> str:
+  """
+  A Sphinx html page with about sections <section>, nested up to depth levels, with header and footer
+
+  :depth:: how many <section> deep, each level adds 1 id to the table of contents of its notes
+  """
+  rnd = random.Random(seed)
+  count = [0]
+
+  def section(level: int, ident: str) -> List[str]:
+    count[0] += 1
+    parts = ['<section id="%s">\n<h%d>Title %s<a class="headerlink" href="#%s">¶</a></h%d>\n'
+             % (ident, min(level, 6), ident, ident, min(level, 6))]
+    parts += _content(rnd, ident, rnd.randint(1, 4))
+    children = 0
+    if level < depth:
+      # the top level has as many sections as needed, the others a few each
+      children = rnd.randint(0, 3) if level > 1 else 1 << 30
+    for j in range(children):
+      if count[0] >= sections:
+        break
+      parts += section(level + 1, ident + '-' + str(j))
+    parts.append('</section>\n')
+    return parts
+
+  return ''.join(['<!DOCTYPE html>\n<html><head><meta charset="utf-8" /><title>Reference</title></head>\n',
+                  '<body><div class="header">header</div>\n<div class="body" role="main">\n']
+                 + section(1, 'module-reference')
+                 + ['</div>\n<div class="footer">footer</div></body></html>\n'])
+
+
+class _ListDedupWriter:
+  """
+  The callback before FragmentWriter: a new byte buffer for each group, and the parent ids found again
+  from parent_nodes for each group
+  """
+  def __init__(self):
+    self.answers, self.table_of_contents = [], []
+
+  def __call__(self, node: ET.Element, **kwargs):
+    string_io = io.BytesIO()
+    ET.ElementTree(node).write(string_io, encoding='utf-8')
+    self.answers.append(string_io.getvalue().decode('utf-8'))
+    string_io.close()
+    attrs = []
+    for n in kwargs.get('parent_nodes', []):
+      if 'id' in n.attrib and n.attrib['id'] not in attrs:
+        attrs.append(n.attrib['id'])
+    self.table_of_contents.append(attrs)
+
+
+def measure(filename: str, repeat: int = 3) -> dict:
+  """
+  Time the fragment emission of 1 page, with the old callback and with FragmentWriter, best of repeat runs
+  """
+  results = {}
+  outputs = {}
+  for name, writerClass in (('bytesIO+listDedup', _ListDedupWriter), ('fragmentWriter', htmlToAnki.FragmentWriter)):
+    best = None
+    for _ in range(repeat):
+      writer = writerClass()
+      start = time.perf_counter()
+      with open(filename, 'r', encoding='utf-8') as f:
+        htmlToAnki.stream_child_groups(f, writer)
+      seconds = time.perf_counter() - start
+      best = seconds if best is None else min(best, seconds)
+    outputs[name] = (writer.answers, writer.table_of_contents)
+    results[name] = {'seconds': round(best, 4), 'fragments': len(writer.answers),
+                     'fragmentsPerSecond': round(len(writer.answers) / best)}
+  first, second = outputs.values()
+  return {'page': filename, 'bytes': os.path.getsize(filename), 'sameOutput': first == second, 'results': results}
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Time the fragment emission of htmlToAnki on a big Sphinx page')
+  parser.add_argument('--page', default=None, help='a real page, like library/stdtypes.html, instead of a generated one')
+  parser.add_argument('--sections', type=int, default=2000, help='generated page: number of <section>')
+  parser.add_argument('--depth', type=int, default=6, help='generated page: how many <section> deep')
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  filename = args.page
+  if not filename:
+    filename = 'sphinxpage-benchmark.html'
+    with open(filename, 'w', encoding='utf-8') as f:
+      f.write(makePage(args.sections, args.depth))
+  try:
+    print(json.dumps(dict(python=sys.version.split()[0], **measure(filename, args.repeat)), indent=2))
+  finally:
+    if not args.page:
+      os.remove(filename)
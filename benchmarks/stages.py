@@ -0,0 +1,106 @@
+from __future__ import annotations
+import argparse, json, os, subprocess, sys, tempfile, time
+from contextlib import contextmanager
+
+from benchmarks.synthetic import makeDocx
+from profiling import peakKB
+
+
+SCALES = (100, 1000, 10000, 100000)
+
+
+@contextmanager
+def _stage(stages: dict, name: str):
+  """
+  Time 1 stage. peakKB is the peak memory of the process so far, so it only goes up from stage to stage
+  """
+  wall, cpu = time.perf_counter(), time.process_time()
+  yield
+  stages[name] = {'wallSeconds': round(time.perf_counter() - wall, 4),
+                  'cpuSeconds': round(time.process_time() - cpu, 4),
+                  'peakKB': peakKB()}
+
+
+def measure(filename: str, stream: bool) -> dict:
+  """
+  Convert 1 document, and time each stage: package open, Node tree, Anki notes, .apkg write. Runs in its own process.
+  """
+  from docx.package import Package
+  from docx2tree import convertParagraphsToTree
+  from codeblocks import CodeBlockIndex
+  from ankimodel import MyModel
+  from myanki import NodeToAnki
+  from docxstream import StreamPackage
+  from mediastore import MediaStore
+  from apkgwriter import MediaPackage
+  import genanki
+
+  stages = {}
+  with _stage(stages, 'open'):
+    package = StreamPackage(filename) if stream else Package.open(filename)
+
+  with _stage(stages, 'tree'):
+    media, allCodeBlocks = MediaStore(), CodeBlockIndex()
+    root = convertParagraphsToTree(package, media, allCodeBlocks)
+
+  with _stage(stages, 'notes'):
+    model = MyModel('Benchmark Model', fields=[{'name': 'Question'}, {'name': 'Answer'}, {'name': 'Media'}, {'name': 'TableOfContent'}])
+    notes = NodeToAnki.createAnkiNotes(root, model, allCodeBlocks)
+
+  fd, output = tempfile.mkstemp(suffix='.apkg')
+  os.close(fd)
+  try:
+    with _stage(stages, 'write'):
+      deck = genanki.Deck(deck_id=1, name='Benchmark')
+      deck.notes = notes
+      MediaPackage(deck, media).write_to_file(output)
+    apkgBytes = os.path.getsize(output)
+  finally:
+    os.remove(output)
+
+  return {'backend': 'stream' if stream else 'python-docx', 'notes': len(notes), 'images': len(media),
+          'apkgBytes': apkgBytes, 'stages': stages,
+          'wallSeconds': round(sum(s['wallSeconds'] for s in stages.values()), 4),
+          'cpuSeconds': round(sum(s['cpuSeconds'] for s in stages.values()), 4),
+          'peakKB': peakKB()}
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Time each stage of a conversion, on generated documents of different sizes')
+  parser.add_argument('--paragraphs', type=int, nargs='+', default=list(SCALES), help='document sizes, default 100 to 100k')
+  parser.add_argument('--heading-depth', type=int, default=3)
+  parser.add_argument('--headings', type=float, default=0.1, help='share of heading paragraphs')
+  parser.add_argument('--lists', type=float, default=0.05, help='share of ©© lists')
+  parser.add_argument('--images', type=float, default=0.01, help='share of ®® pictures')
+  parser.add_argument('--code', type=float, default=0.01, help='share of ¨¨ code tables')
+  parser.add_argument('--stream', action='store_true', help='read with StreamPackage instead of python-docx')
+  parser.add_argument('--output', '-o', default=None, help='write the JSON here instead of stdout')
+  parser.add_argument('--child', metavar='DOCX', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    print(json.dumps(measure(args.child, args.stream)))
+    sys.exit(0)
+
+  results = []
+  for paragraphs in args.paragraphs:
+    fd, filename = tempfile.mkstemp(suffix='.docx')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(makeDocx(paragraphs, args.heading_depth, args.headings, args.lists, args.images, args.code))
+    try:
+      # each size in a fresh process, so the peak memory of a big document does not hide a small one
+      command = [sys.executable, '-m', 'benchmarks.stages', '--child', filename] + (['--stream'] if args.stream else [])
+      result = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+    finally:
+      os.remove(filename)
+    result = dict(paragraphs=paragraphs, document={'headingDepth': args.heading_depth, 'headings': args.headings,
+                  'lists': args.lists, 'images': args.images, 'code': args.code}, **result)
+    results.append(result)
+    print(paragraphs, 'paragraphs:', result['wallSeconds'], 's', file=sys.stderr)
+
+  report = json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(report + '\n')
+  else:
+    print(report)
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import io, random, struct, zipfile, zlib
+from typing import List
+from xml.sax.saxutils import escape
+
+import docx
+
+
+NS_A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+NS_PIC = 'http://schemas.openxmlformats.org/drawingml/2006/picture'
+RT_IMAGE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+WORDS = ('anki', 'note', 'heading', 'python', 'memory', 'tree', 'paragraph', 'document', 'card', 'review',
+         'list', 'image', 'table', 'code', 'style', 'bold', 'italic', 'run', 'deck', 'model')
+
+
+def _run(text: str, bold: bool = False, italic: bool = False) -> str:
+  rPr = ('<w:b/>' if bold else '') + ('<w:i/>' if italic else '')
+  return '<w:r>' + ('<w:rPr>' + rPr + '</w:rPr>' if rPr else '') \
+    + '<w:t xml:space="preserve">' + escape(text) + '</w:t></w:r>'
+
+
+def _paragraph(runs: str, style: str = None) -> str:
+  pPr = '<w:pPr><w:pStyle w:val="' + style + '"/></w:pPr>' if style else ''
+  return '<w:p>' + pPr + runs + '</w:p>'
+
+
+def _sentence(rnd: random.Random) -> str:
+  """
+  A normal line with 3 runs: plain, bold or italic, plain
+  """
+  words = [rnd.choice(WORDS) for _ in range(12)]
+  return _run(' '.join(words[0:5]) + ' ') + _run(' '.join(words[5:7]), bold=rnd.random() < 0.7, italic=True) \
+    + _run(' ' + ' '.join(words[7:]) + '.')
+
+
+def _png(index: int) -> bytes:
+  """
+  A tiny 8x8 png of 1 color. Each index gets a different color, so every image is a different file
+  """
+  color = bytes(((index * 67) % 256, (index * 151) % 256, (index // 256 * 37 + index) % 256))
+  raw = b''.join(b'\x00' + color * 8 for _ in range(8))
+
+  def chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+  return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 8, 8, 8, 2, 0, 0, 0)) \
+    + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+def _picture(rId: str, index: int) -> str:
+  """
+  A paragraph with 1 inline picture, the same xml Word writes
+  """
+  return '<w:p><w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">' \
+    '<wp:extent cx="914400" cy="914400"/><wp:docPr id="' + str(index + 1) + '" name="Picture ' + str(index + 1) + '"/>' \
+    '<a:graphic xmlns:a="' + NS_A + '"><a:graphicData uri="' + NS_PIC + '"><pic:pic xmlns:pic="' + NS_PIC + '">' \
+    '<pic:nvPicPr><pic:cNvPr id="0" name="image' + str(index + 1) + '.png"/><pic:cNvPicPr/></pic:nvPicPr>' \
+    '<pic:blipFill><a:blip r:embed="' + rId + '"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>' \
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="914400" cy="914400"/></a:xfrm><a:prstGeom prst="rect"/></pic:spPr>' \
+    '</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'
+
+
+def _codeTable(key: str, lines: List[str]) -> str:
+  """
+  A 1x1 table, the first line of the cell is the key of the code block
+  """
+  cell = ''.join(_paragraph(_run(line)) for line in [key] + lines)
+  return '<w:tbl><w:tblPr><w:tblW w:w="0" w:type="auto"/></w:tblPr><w:tblGrid><w:gridCol w:w="8640"/></w:tblGrid>' \
+    '<w:tr><w:tc><w:tcPr><w:tcW w:w="8640" w:type="dxa"/></w:tcPr>' + cell + '</w:tc></w:tr></w:tbl>'
+
+
+def makeDocx(paragraphs: int = 10000, headingDepth: int = 3, headingShare: float = 0.1,
+             listShare: float = 0.0, imageShare: float = 0.0, codeShare: float = 0.0, seed: int = 0) -> bytes:
+  """
+  Generate a .docx with this many paragraphs
+
+  The xml is written directly, python-docx is only used for an empty document with all the built-in styles.
+  That is much faster than python-docx add_paragraph(), so 100k paragraphs take seconds.
+
+  :headingDepth:: headings go from Heading 1 to Heading <headingDepth>
+  :headingShare:: how many paragraphs are headings, 0.1 means 10%
+  :listShare:: how many paragraphs start a ©© list, followed by 2 to 4 lines
+  :imageShare:: how many paragraphs are a ®® line, followed by a picture paragraph
+  :codeShare:: how many paragraphs are a ¨¨ line, followed by a 1x1 code table
+  @return the .docx binary
+  """
+  rnd = random.Random(seed)
+  body = [_paragraph(_run('Synthetic document'), 'Title')]
+  images: List[bytes] = []
+  level = 0
+  remaining = paragraphs - 1
+  while remaining > 0:
+    kind = rnd.random()
+    if kind < headingShare:
+      # go at most 1 level deeper, or back to any higher level
+      level = rnd.randint(1, min(level + 1, headingDepth))
+      body.append(_paragraph(_run('Heading ' + str(len(body))), 'Heading' + str(level)))
+      remaining -= 1
+      continue
+    kind -= headingShare
+
+    if kind < listShare and remaining > 2:
+      length = min(rnd.randint(2, 4), remaining - 1)
+      body.append(_paragraph(_run('©©' + str(length) + ' List of ' + str(length) + ' lines:')))
+      body += [_paragraph(_sentence(rnd)) for _ in range(length)]
+      remaining -= length + 1
+    elif listShare <= kind < listShare + imageShare and remaining > 1:
+      rId = 'rIdSynthetic' + str(len(images) + 1)
+      body.append(_paragraph(_run('®®' + str(rnd.choice((0, 0, 1, 2))) + ' Picture ' + str(len(images) + 1))))
+      body.append(_picture(rId, len(images)))
+      images.append(_png(len(images)))
+      remaining -= 2
+    elif listShare + imageShare <= kind < listShare + imageShare + codeShare:
+      key = '¨¨CodeBlock' + str(len(body))
+      body.append(_paragraph(_run(key)))
+      body.append(_codeTable(key, ['def f' + str(i) + '(x):' if i == 0 else '  return x + ' + str(i) for i in range(rnd.randint(2, 8))]))
+      remaining -= 1
+    else:
+      body.append(_paragraph(_sentence(rnd)))
+      remaining -= 1
+
+  template = io.BytesIO()
+  docx.Document().save(template)
+  with zipfile.ZipFile(template) as z:
+    parts = {name: z.read(name) for name in z.namelist()}
+
+  document = parts['word/document.xml'].decode('utf-8')
+  bodyStart = document.index('<w:body>') + len('<w:body>')
+  parts['word/document.xml'] = (document[:bodyStart] + ''.join(body) + document[bodyStart:]).encode('utf-8')
+
+  if images:
+    rels = parts['word/_rels/document.xml.rels'].decode('utf-8')
+    newRels = ''.join('<Relationship Id="rIdSynthetic' + str(i + 1) + '" Type="' + RT_IMAGE + '" Target="media/image' + str(i + 1) + '.png"/>'
+                      for i in range(len(images)))
+    parts['word/_rels/document.xml.rels'] = rels.replace('</Relationships>', newRels + '</Relationships>').encode('utf-8')
+    contentTypes = parts['[Content_Types].xml'].decode('utf-8')
+    if 'Extension="png"' not in contentTypes:
+      contentTypes = contentTypes.replace('<Default ', '<Default Extension="png" ContentType="image/png"/><Default ', 1)
+    parts['[Content_Types].xml'] = contentTypes.encode('utf-8')
+    for i, binary in enumerate(images):
+      parts['word/media/image' + str(i + 1) + '.png'] = binary
+
+  output = io.BytesIO()
+  with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+    for name, binary in parts.items():
+      z.writestr(name, binary)
+  return output.getvalue()
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Generate a big .docx for benchmarks')
+  parser.add_argument('output')
+  parser.add_argument('--paragraphs', type=int, default=10000)
+  parser.add_argument('--heading-depth', type=int, default=3)
+  parser.add_argument('--headings', type=float, default=0.1, help='share of heading paragraphs')
+  parser.add_argument('--lists', type=float, default=0.0, help='share of ©© lists')
+  parser.add_argument('--images', type=float, default=0.0, help='share of ®® pictures')
+  parser.add_argument('--code', type=float, default=0.0, help='share of ¨¨ code tables')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+  with open(args.output, 'wb') as f:
+    f.write(makeDocx(args.paragraphs, args.heading_depth, args.headings, args.lists, args.images, args.code, args.seed))
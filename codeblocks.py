@@ -0,0 +1,103 @@
+from __future__ import annotations
+import copy
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+
+if TYPE_CHECKING:
+  from lxml import etree
+
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+CODE_MARK = '¨¨'
+
+
+class CodeBlockIndex:
+  """
+  Find the code block ( 1x1 table ) of a ¨¨ line, filled while the paragraphs are read
+
+  Only 1x1 tables whose first line starts with ¨¨ are kept, all other tables are skipped without reading their text.
+  The cell xml is kept, its text is only read when a note needs it.
+
+  Example:
+  ```text
+  ¨¨HelloWorldEg
+  ----------------------
+  |¨¨HelloWorldEg      |
+  |print("Hello world")|
+  ----------------------
+  ```
+  ```python
+  codeBlocks = CodeBlockIndex()
+  root = convertParagraphsToTree(package, media, codeBlocks)
+  codeBlocks.get('¨¨HelloWorldEg')
+  >>> '¨¨HelloWorldEg\nprint("Hello world")'
+  codeBlocks.get('¨¨NotThere')
+  >>> None
+  ```
+  """
+  def __init__(self):
+    # key -> ( copy of the <w:tc> cell, function to read the text of 1 <w:p> )
+    self.cells: Dict[str, Tuple[etree._Element, Callable]] = {}
+    # key -> all the text, for code blocks read by an earlier run, check addText()
+    self.texts: Dict[str, str] = {}
+
+  @staticmethod
+  def key(text: str) -> str:
+    """
+    The first line, without spaces around it, so a trailing space on the ¨¨ line still finds its table
+    """
+    return text.partition('\n')[0].strip()
+
+  def addTable(self, tbl: etree._Element, paragraphText: Callable[[etree._Element], str]) -> bool:
+    """
+    Keep this <w:tbl> if it is a code block
+
+    :paragraphText:: reads the text of 1 <w:p>, the same way the paragraphs outside the table are read
+
+    @return True if it was a code block
+    """
+    rows = tbl.findall(W+'tr')
+    if len(rows) != 1:
+      return False
+    cells = rows[0].findall(W+'tc')
+    if len(cells) != 1:
+      return False
+    firstParagraph = cells[0].find(W+'p')
+    if firstParagraph is None:
+      return False
+    firstLine = paragraphText(firstParagraph)
+    if not firstLine.startswith(CODE_MARK):
+      return False
+    # a copy of the cell only, so the rest of the document xml can be freed
+    self.cells[self.key(firstLine)] = (copy.deepcopy(cells[0]), paragraphText)
+    return True
+
+  def addText(self, text: str):
+    """
+    Add a code block from its text, the same as get() returned, like the ones a NoteCache keeps
+    """
+    self.texts[self.key(text)] = text
+
+  def allTexts(self) -> List[str]:
+    """
+    The text of every code block, each of them can be added again with addText()
+    """
+    return [self.get(key) for key in self.cells] + list(self.texts.values())
+
+  def get(self, key: str, default: str = None) -> str:
+    """
+    @return all the text of the code block, 1 line per paragraph, or default if there is no code block for key
+    """
+    if self.key(key) in self.texts:
+      return self.texts[self.key(key)]
+    found = self.cells.get(self.key(key))
+    if found is None:
+      return default
+    cell, paragraphText = found
+    return '\n'.join(paragraphText(p) for p in cell.iterchildren(W+'p'))
+
+  def __contains__(self, key: str) -> bool:
+    return self.key(key) in self.cells or self.key(key) in self.texts
+
+  def __len__(self):
+    return len(self.cells) + len(self.texts)
@@ -1,19 +1,29 @@
 from __future__ import annotations
-import os, io, shutil, re, warnings
+import itertools, posixpath, warnings
 
-from typing import List, Dict
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Tuple
 
-# from PIL import Image
+# python-docx is only imported when a document is read with it, not with StreamPackage
+if TYPE_CHECKING:
+  from docx.text.paragraph import Paragraph
+  from docx.oxml.text.paragraph import CT_P
+  from docx.text.run import Run
+  from docx.opc.package import OpcPackage
+  from docx.opc.part import Part
 
-# from docx.text.paragraph import Paragraph
-# from docx.table import Table
-# from docx.text.run import Run
-# from docx.package import Package, OpcPackage
+from node import Node, PhotoNode, ParagraphRecord, StyleRecord, MARKER_PICTURE, MARKER_LIST
+from docxstream import StreamPackage, W, RT_IMAGE
+from mediastore import MediaStore
+from codeblocks import CodeBlockIndex
+from profiling import Profiler, NO_PROFILER
 
-from node import Node, PhotoNode
 
+W_P = W + 'p'
+W_TBL = W + 'tbl'
 
-def convertParagraphsToTree(package: OpcPackage) -> Node:
+
+def convertParagraphsToTree(package: OpcPackage, media: MediaStore = None, codeBlocks: CodeBlockIndex = None,
+                            profiler: Profiler = NO_PROFILER, paragraphs: Iterable[ParagraphRecord] = None) -> Node:
   """
   Convert a docx file package into internal Node tree structure
   
@@ -29,6 +39,7 @@ def convertParagraphsToTree(package: OpcPackage) -> Node:
   package = Package.open(f)
   f.close()
   ```
+  Or a StreamPackage, which reads the paragraphs without python-docx, check docxstream.py
   
   Node parent/children structure is based on Headings in Document
 
@@ -42,69 +53,86 @@ def convertParagraphsToTree(package: OpcPackage) -> Node:
   root.children[1] => word1\n
   root.children[2] => Heading2\n
   root.children[2].children[1] => word2
+
+  The images inside the docx are added into media, as they are, without writing any file.
+  The code blocks ( ¨¨ 1x1 tables ) are added into codeBlocks, in the same pass as the paragraphs.
+
+  profiler counts paragraphs and nodes, and times the 'images' stage, check profiling.py
+
+  paragraphs: the ParagraphRecords of the document, if they were read before ( like from a NoteCache ).
+  Then package is only used for the images, and codeBlocks must already have the code blocks.
   """
-  # reset image directory first
-  shutil.rmtree('image', ignore_errors=True)
-  os.mkdir('image')
-  
-  paragraphs = DocxToNode.getAllParagraphs(package)
+  if media is None:
+    media = MediaStore()
+
+  # Paragraphs are read 1 by 1, so a StreamPackage never needs all of them in memory
+  if paragraphs is None:
+    paragraphs = DocxToNode.getAllParagraphs(package, codeBlocks)
+  paragraphs = iter(paragraphs)
+  imageParts = DocxToNode.getImagePartIndex(package)
   root = Node(None, [])
   curParent = root
   cur_heading_level = 0
 
-  # for loop does not work, https://stackoverflow.com/a/47532461
-  i = 0
-  while(i < len(paragraphs)):
-    p_style = DocxToNode.getParagraphStyle(paragraphs[i]).split()
+  # Each paragraph is classified once when it is read ( check ParagraphRecord.create ), the checks below only read fields
+  for para in paragraphs:
+    profiler.count('paragraphs')
+    heading_level = para.style.level
     
-    if p_style[0] != 'heading':
+    if not heading_level:
       
-      if DocxToNode.isPicture(paragraphs[i]):
-        newNode = DocxToNode.createPhotoNote(paragraphs[i], paragraphs[i+1], package, curParent)
-        curParent.add(newNode)
-        # increment i here 1 more than normal, because a PhotoNode paragraph takes 2 paragraphs
-        i += 1
+      if DocxToNode.isPicture(para):
+        # A PhotoNode takes 2 paragraphs, so the next paragraph is consumed here too
+        with profiler.stage('images'):
+          newNode = DocxToNode.createPhotoNote(para, next(paragraphs, None), imageParts, curParent, media)
+        profiler.count('paragraphs')
+        if newNode:
+          curParent.add(newNode)
+          profiler.count('photoNodes')
       
-      elif DocxToNode.lengthOfBulletList(paragraphs[i]) > 0:
-        howManyLinesToSkip = DocxToNode.lengthOfBulletList(paragraphs[i])
-        group_paragraphs = paragraphs[i:i+howManyLinesToSkip+1]
+      elif DocxToNode.lengthOfBulletList(para) > 0:
+        howManyLinesToSkip = para.markerCount
+        group_paragraphs = [para] + list(itertools.islice(paragraphs, howManyLinesToSkip))
         newNode = Node(curParent, group_paragraphs)
         curParent.add(newNode)
-        i += howManyLinesToSkip
+        profiler.count('paragraphs', len(group_paragraphs) - 1)
+        profiler.count('listNodes')
 
       # normal paragraph, treat as same level as current level, check if this line is not empty
-      elif DocxToNode.isNormalParagraph(paragraphs[i]) and not DocxToNode.isEmptyParagraph(paragraphs[i]):
-        newNode = Node(curParent, [paragraphs[i]])
+      elif DocxToNode.isNormalParagraph(para) and not DocxToNode.isEmptyParagraph(para):
+        newNode = Node(curParent, [para])
         curParent.add(newNode)
+        profiler.count('textNodes')
 
       # If the heading line is actually empty, then skip to next one
-      # else:#if DocxToNode.isEmptyParagraph(paragraphs[i]):
+      # else:#if DocxToNode.isEmptyParagraph(para):
     
-    elif p_style[0] == 'heading':
+    else:
     
       # new paragraph has lower(bigger) heading, so move parent node must be higher up, closer to root
-      if int(p_style[1]) <= cur_heading_level:
-        for _ in range(int(p_style[1]), cur_heading_level + 1):
+      if heading_level <= cur_heading_level:
+        for _ in range(heading_level, cur_heading_level + 1):
           curParent = curParent.parent
       
       # This should go in either bigger heading, or smaller heading ( child node ).
       # New node is created under current parent
-      new_node = Node(curParent, [paragraphs[i]])
+      new_node = Node(curParent, [para])
       curParent.add(new_node)
       curParent = new_node
-      cur_heading_level = int(p_style[1])
-    
-    i += 1
+      cur_heading_level = heading_level
+      profiler.count('headingNodes')
   
   return root
 
 class DocxToNode:
   
   @staticmethod
-  def getAllParagraphs(docxPackage: OpcPackage) -> List[Paragraph]:
+  def getAllParagraphs(docxPackage: OpcPackage, codeBlocks: CodeBlockIndex = None) -> Iterator[ParagraphRecord]:
     """
     Convert from python-docx->Package into list of sentences ( python-docx called paragraph )
 
+    Each paragraph is copied into a ParagraphRecord, so the Node tree does not keep the xml alive
+
     Docx documents is stored in XML format.
     Paragraph is basically infos inside <w:p> tags
 
@@ -130,13 +158,54 @@ class DocxToNode:
       1) convert .docx to .zip, and unzip\n
       2) open document.xwl in text editor
 
+    The tables between the paragraphs are checked on the way, the code blocks go into codeBlocks
+    """
+    if isinstance(docxPackage, StreamPackage):
+      return docxPackage.iterParagraphs(codeBlocks)
+    return DocxToNode._iterParagraphs(docxPackage, codeBlocks)
+
+  @staticmethod
+  def _iterParagraphs(docxPackage: OpcPackage, codeBlocks: CodeBlockIndex = None) -> Iterator[ParagraphRecord]:
+    from docx.text.paragraph import Paragraph
+    styles, defaultStyle = DocxToNode.getStyleIndex(docxPackage)
+    document = docxPackage.main_document_part.document
+    # same as document.iter_inner_content(), without its xpath over the whole body
+    for element in document.element.body.iterchildren(W_P, W_TBL):
+      if element.tag == W_TBL:
+        if codeBlocks is not None:
+          codeBlocks.addTable(element, DocxToNode._paragraphText)
+      else:
+        yield ParagraphRecord.fromParagraph(Paragraph(element, document._body), styles.get(element.style, defaultStyle))
+
+  @staticmethod
+  def getStyleIndex(docxPackage: OpcPackage) -> Tuple[Dict[str, StyleRecord], StyleRecord]:
+    """
+    Map each paragraph style id to its StyleRecord, once per document
+
+    python-docx para.style looks for the style again on every paragraph, and for a paragraph without a style,
+    goes through all the styles to find the default one. Same rules here, but only once.
+
+    @return { style id: StyleRecord }, and the StyleRecord of the default paragraph style
     """
-    return docxPackage.main_document_part.document.paragraphs
+    from docx.enum.style import WD_STYLE_TYPE
+    styles = docxPackage.main_document_part.document.styles
+    index = {}
+    for s in styles:
+      if s.type == WD_STYLE_TYPE.PARAGRAPH:
+        index.setdefault(s.style_id, ParagraphRecord.styleRecord(s.name))
+    default = styles.default(WD_STYLE_TYPE.PARAGRAPH)
+    return index, ParagraphRecord.styleRecord(default.name) if default is not None else None
+
+  @staticmethod
+  def _paragraphText(p: CT_P) -> str:
+    return p.text
   
   @staticmethod
-  def getAllTables(docxPackage: OpcPackage) -> Dict[str, Table]:
+  def getAllTables(docxPackage: OpcPackage) -> CodeBlockIndex:
     """
-    Get all the tables ( 1x1 only ) inside docx, where first line in the table as Key
+    Get all the code blocks ( 1x1 tables starting with ¨¨ ) inside docx, where first line in the table as Key
+
+    This reads the document again, convertParagraphsToTree() can fill a CodeBlockIndex in the same pass instead
 
     Example:
     ```text
@@ -146,11 +215,15 @@ class DocxToNode:
     ----------------------
     ```
     
-    @return  a dictionary { key: `¨¨HelloWorldEg`, value: `¨¨HelloWorldEg  print("Hello world")`
+    @return  a CodeBlockIndex { key: `¨¨HelloWorldEg`, value: `¨¨HelloWorldEg  print("Hello world")` }
     """
-    result = {}
+    result = CodeBlockIndex()
+    if isinstance(docxPackage, StreamPackage):
+      for _ in docxPackage.iterParagraphs(result):
+        pass
+      return result
     for t in docxPackage.main_document_part.document.tables:
-      result[t.cell(0,0).text.partition('\n')[0]] = t.cell(0,0).text
+      result.addTable(t._tbl, DocxToNode._paragraphText)
     return result
   
   @staticmethod
@@ -189,14 +262,14 @@ class DocxToNode:
     """
     Check for empty sentence ( paragraph ) in docx file
     """
-    return not para.text.replace(' ', '').replace('\t', '').replace('\n', '')
+    return para.empty
   
   @classmethod
   def isNormalParagraph(cls, para: Paragraph) -> bool:
     """
     Check if this sentence ( paragraph ) is normal, not a heading
     """
-    return cls.getParagraphStyle(para).split()[0] == 'normal'
+    return para.style.kind == 'normal'
 
   @staticmethod
   def lengthOfBulletList(para: Paragraph) -> int:
@@ -215,9 +288,9 @@ class DocxToNode:
     All of these will show in 1 Anki note only
     
     """
-    if para.text[0:2] == '©©' and para.text[2].isnumeric():
+    if para.marker == MARKER_LIST:
       # return number of lines this list has, indicate after ©©
-      return int(para.text.split()[0].replace('©©', ''))
+      return para.markerCount
     return -1
   
   @staticmethod
@@ -247,61 +320,49 @@ class DocxToNode:
     Each note has image1.png in it.
 
     """
-    return para.text[0:2] == '®®' and para.text[2].isnumeric()
+    return para.marker == MARKER_PICTURE
   
   @staticmethod
-  def getImageName(para: Paragraph ) -> str:
+  def getImageRId(para: Paragraph) -> str:
     """
-    Get the image filename stored inside the docx's xml
+    Get the relationship id of the picture inside this paragraph
 
-    It always start as imageXX.EXT
+    The picture only has an id, the id points to the image file inside the docx.
 
     Example:
     ```xml
     <w:r>
-      <w:rPr/>
       <w:drawing>
       ...
-                  <pic:cNvPr id="0" name="image2.png"/>
+              <a:blip r:embed="rId6"/>
       ...
       </w:drawing>
     </w:r>
     ```
 
-    @return `**image2.png**`
+    @return `**rId6**`, or "" if this paragraph has no picture
     """
-    if not DocxToNode.getParagraphRuns(para):
+    if not para or not para.embeds:
       return ""
-    cur_xml = DocxToNode.getParagraphRuns(para)[0].element.xml
-    regex_match = re.search("image[0-9]*.[a-zA-Z]+", cur_xml)
-    if regex_match:
-      return regex_match.group(0)
-    return ""
-  
+    return para.embeds[0]
+
   @staticmethod
-  def getImageIndex(package: OpcPackage, imageName: str) -> int:
+  def getImagePartIndex(package: OpcPackage) -> Dict[str, Part]:
     """
-    Get the image stored inside document file structure
-
-    `package.image_parts._image_parts[i].partname` get the image path of inner file structure
+    Map each relationship id of the document, to its image file inside the docx.
+    Build this once per document, each picture is then found by its id directly.
 
-    /word/media/image1.png\n
-    /word/media/image1.png\n
-    /word/media/image2.png
+    Each image part has a partname ( /word/media/image1.png ) and a blob ( the binary )
 
-    @return the index that match the filename. For image2.png, it returns 2
+    @return { 'rId6': ImagePart(/word/media/image1.png), 'rId7': ImagePart(/word/media/image2.png) }
     """
-    document = package.main_document_part.document
-    for i in range(len(document.paragraphs)):
-      if i >= len(package.image_parts._image_parts):
-        raise Exception('The Save function from Microsoft Word create a different image name for each image, please use Google Docs and export as .docx file only')
-      
-      if imageName in package.image_parts._image_parts[i].partname:
-        return i
-    return -1
+    if isinstance(package, StreamPackage):
+      return package.imagePartIndex()
+    return {rId: rel.target_part for rId, rel in package.main_document_part.rels.items()
+            if rel.reltype == RT_IMAGE and not rel.is_external}
   
   @staticmethod
-  def createPhotoNote(paraRR: Paragraph, nextPara: Paragraph, package: OpcPackage, curParent: Node) -> PhotoNode:
+  def createPhotoNote(paraRR: Paragraph, nextPara: Paragraph, imageParts: Dict[str, Part], curParent: Node, media: MediaStore) -> PhotoNode:
     """
     Create a PhotoNode, based on 2 paragraphs
     
@@ -309,30 +370,32 @@ class DocxToNode:
 
     Check the docstring on isPicture()
 
+    imageParts comes from getImagePartIndex()
+
     show_on_children_level: 0 means only show this pic on 1 Anki Note\n
     , 1 means shows on this level's notes\n
     , 2 means this level and next children's level
     """
     imageInfo = [paraRR]
-    show_on_children_level = int(paraRR.text[2])
+    show_on_children_level = paraRR.markerCount
 
-    image_name = DocxToNode.getImageName(nextPara)
-    if not image_name:
+    image_rid = DocxToNode.getImageRId(nextPara)
+    if image_rid not in imageParts:
       warnings.warn("Cannot process image : " + imageInfo[0].text)
       return None
 
-    image_index = DocxToNode.getImageIndex(package, image_name)
-
-    img_binary = package.image_parts._image_parts[image_index].blob
-    image = Image.open(io.BytesIO(img_binary))
-    image.save('image/'+image_name)
+    # Every image file inside a docx has a different name, so it is used as the Anki media name.
+    # The binary is copied as it is, an image that is already in media keeps its first name
+    image_part = imageParts[image_rid]
+    image_name = media.add(posixpath.basename(image_part.partname), image_part.blob)
 
-    return PhotoNode(curParent, image_name, image_index, show_on_children_level, imageInfo)
+    return PhotoNode(curParent, image_name, image_rid, show_on_children_level, imageInfo)
 
 
 
 
 if __name__ == "__main__":
+  from docx.package import Package
   f = open('Microsoft Word Documents to Anki converter demo.docx', 'rb')
   pp = Package.open(f)
   f.close()
@@ -0,0 +1,268 @@
+from __future__ import annotations
+import hashlib, posixpath
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, Set
+
+# lxml and zipfile are imported when a document is read, not when the module is imported
+if TYPE_CHECKING:
+  import zipfile
+  from lxml import etree
+
+from node import RunRecord, ParagraphRecord, StyleRecord
+from codeblocks import CodeBlockIndex
+
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+V = '{urn:schemas-microsoft-com:vml}'
+RELS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+RT_OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+RT_STYLES = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles'
+RT_IMAGE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+# Same as python-docx BabelFish: the styles.xml name of a built-in style -> the name Word shows, like para.style.name
+# A copy, so reading a document with StreamPackage never imports python-docx
+UI_STYLE_NAMES = dict([('caption', 'Caption'), ('footer', 'Footer'), ('header', 'Header')]
+                      + [('heading %d' % i, 'Heading %d' % i) for i in range(1, 10)])
+
+# Same as python-docx Run.text, each of these run children becomes some text
+RUN_TEXT = {W+'t': None, W+'tab': '\t', W+'ptab': '\t', W+'cr': '\n', W+'noBreakHyphen': '-'}
+
+
+class StreamImagePart:
+  """
+  An image file inside the .docx, like python-docx ImagePart. The binary is only read when needed
+  """
+  def __init__(self, zipFile: zipfile.ZipFile, partname: str):
+    self.zipFile = zipFile
+    self.partname = partname
+
+  @property
+  def blob(self) -> bytes:
+    return self.zipFile.read(self.partname.lstrip('/'))
+
+
+class ParagraphMemo:
+  """
+  The ParagraphRecord of each paragraph of the last read, keyed by the xml of the paragraph, for a process that
+  reads the same document again after each small edit ( --watch )
+
+  A paragraph whose xml did not change is not converted again, check StreamPackage.iterParagraphs().
+  Paragraphs not seen since the last sweep() are dropped, so memory stays about the size of 1 document.
+  If the styles change, all records are dropped, the same xml can have another style name.
+
+  Example:
+  ```python
+  memo = ParagraphMemo()
+  while True:
+    package, codeBlocks = StreamPackage('Document.docx'), CodeBlockIndex()
+    root = convertParagraphsToTree(package, None, codeBlocks, paragraphs=package.iterParagraphs(codeBlocks, memo))
+    memo.sweep()
+  ```
+  """
+  def __init__(self):
+    self.records: Dict[bytes, ParagraphRecord] = {}
+    self.used: Set[bytes] = set()
+    self.styles = None
+    self.hits = 0
+    self.misses = 0
+
+  def useStyles(self, styles: Dict[str, StyleRecord], defaultStyle: StyleRecord):
+    if (styles, defaultStyle) != self.styles:
+      self.records, self.used = {}, set()
+      self.styles = (styles, defaultStyle)
+
+  def get(self, xml: bytes, element: etree._Element, toRecord: Callable[[etree._Element], ParagraphRecord]) -> ParagraphRecord:
+    """
+    The record of xml from the last read, or toRecord(element)
+    """
+    record = self.records.get(xml)
+    if record is None:
+      self.misses += 1
+      record = self.records[xml] = toRecord(element)
+    else:
+      self.hits += 1
+    self.used.add(xml)
+    return record
+
+  def sweep(self):
+    """
+    Forget the paragraphs that were not read since the last sweep()
+    """
+    self.records = {xml: record for xml, record in self.records.items() if xml in self.used}
+    self.used = set()
+
+
+class StreamPackage:
+  """
+  Read a .docx without python-docx object model, 1 paragraph at a time
+
+  python-docx parses the whole word/document.xml into a tree, and wraps every paragraph and run
+  into a proxy object, that reads the xml again on every .text / .style / .runs.
+  This reads word/document.xml with an incremental parser instead. Each top level <w:p> becomes a
+  ParagraphRecord, and its xml is thrown away right after.
+
+  Example:
+  ```python
+  package = StreamPackage('Document.docx')
+  root = convertParagraphsToTree(package)
+  ```
+
+  The code blocks ( 1x1 tables ) are collected while reading paragraphs, check iterParagraphs()
+  """
+  def __init__(self, file):
+    import zipfile
+    self.zipFile = zipfile.ZipFile(file)
+    self.documentPartname = self._getDocumentPartname()
+    self.rels = self._getRels(self.documentPartname)
+    self.styles, self.defaultStyle = self._getStyles()
+
+  def imagePartIndex(self) -> Dict[str, StreamImagePart]:
+    """
+    @return { rId: image file }, same as DocxToNode.getImagePartIndex()
+    """
+    return {rId: StreamImagePart(self.zipFile, target) for rId, (rtype, target) in self.rels.items() if rtype == RT_IMAGE}
+
+  def signature(self) -> str:
+    """
+    sha1 of the xml the paragraphs are read from: word/document.xml and the styles.
+    2 documents with the same signature have the same ParagraphRecords and code blocks, even if their images differ
+    """
+    h = hashlib.sha1(self._read(self.documentPartname))
+    for rtype, target in self.rels.values():
+      if rtype == RT_STYLES:
+        h.update(b'\x00styles' + self._read(target))
+    return h.hexdigest()
+
+  def _read(self, partname: str) -> bytes:
+    return self.zipFile.read(partname.lstrip('/'))
+
+  def _getDocumentPartname(self) -> str:
+    from lxml import etree
+    rels = etree.fromstring(self._read('/_rels/.rels'))
+    for rel in rels.iter(RELS+'Relationship'):
+      if rel.get('Type') == RT_OFFICE_DOCUMENT:
+        return posixpath.normpath(posixpath.join('/', rel.get('Target')))
+    raise KeyError('No main document in package')
+
+  def _getRels(self, partname: str) -> Dict[str, tuple]:
+    """
+    @return { rId: (relationship type, partname) } of a part, like { 'rId6': (RT_IMAGE, '/word/media/image1.png') }
+    """
+    from lxml import etree
+    directory, filename = posixpath.split(partname)
+    relsName = posixpath.join(directory, '_rels', filename + '.rels')
+    if relsName.lstrip('/') not in self.zipFile.namelist():
+      return {}
+    result = {}
+    for rel in etree.fromstring(self._read(relsName)).iter(RELS+'Relationship'):
+      if rel.get('TargetMode') == 'External':
+        continue
+      result[rel.get('Id')] = (rel.get('Type'), posixpath.normpath(posixpath.join(directory, rel.get('Target'))))
+    return result
+
+  def _getStyles(self):
+    """
+    Map each paragraph style id to its name, the same way python-docx resolves para.style
+
+    A paragraph without a style, or with an unknown style, gets the default paragraph style.
+    """
+    from lxml import etree
+    stylesPartnames = [target for rtype, target in self.rels.values() if rtype == RT_STYLES]
+    if not stylesPartnames:
+      return {}, ParagraphRecord.styleRecord('Normal')
+
+    styles, default = {}, None
+    for s in etree.fromstring(self._read(stylesPartnames[0])).iterchildren(W+'style'):
+      if s.get(W+'type') != 'paragraph':
+        continue
+      nameElement = s.find(W+'name')
+      name = None if nameElement is None else UI_STYLE_NAMES.get(nameElement.get(W+'val'), nameElement.get(W+'val'))
+      style = ParagraphRecord.styleRecord(name)
+      styles.setdefault(s.get(W+'styleId'), style)
+      if s.get(W+'default') in ('1', 'true', 'on'):
+        # spec calls for last default in document order
+        default = style
+    return styles, default
+
+  def iterParagraphs(self, codeBlocks: CodeBlockIndex = None, memo: ParagraphMemo = None) -> Iterator[ParagraphRecord]:
+    """
+    Yield the ParagraphRecord of every paragraph in the document body, same order as document.paragraphs
+
+    The code block tables found on the way are added into codeBlocks
+    With a memo, the paragraphs with the same xml as in the last read get their record from it
+    """
+    from lxml import etree
+    if memo is not None:
+      memo.useStyles(self.styles, self.defaultStyle)
+    with self.zipFile.open(self.documentPartname.lstrip('/')) as f:
+      for _, element in etree.iterparse(f, events=('end',), tag=(W+'p', W+'tbl')):
+        parent = element.getparent()
+        # paragraphs inside a table are read together with their table
+        if parent is None or parent.tag != W+'body':
+          continue
+
+        if element.tag == W+'p':
+          if memo is None:
+            yield self._toParagraphRecord(element)
+          else:
+            yield memo.get(etree.tostring(element), element, self._toParagraphRecord)
+        elif codeBlocks is not None:
+          codeBlocks.addTable(element, self.paragraphText)
+
+        # free the xml that was already read
+        element.clear()
+        while element.getprevious() is not None:
+          del parent[0]
+
+  def _toParagraphRecord(self, p: etree._Element) -> ParagraphRecord:
+    pStyle = p.find(W+'pPr/'+W+'pStyle')
+    style = self.styles.get(pStyle.get(W+'val'), self.defaultStyle) if pStyle is not None else self.defaultStyle
+
+    runs, texts = [], []
+    for child in p:
+      if child.tag == W+'r':
+        run = self._toRunRecord(child)
+        runs.append(run)
+        texts.append(run.text)
+      elif child.tag == W+'hyperlink':
+        texts += [self._toRunRecord(r).text for r in child.iterchildren(W+'r')]
+
+    # old .doc pictures converted by Word use <v:imagedata r:id="rId6"/> instead of <a:blip r:embed="rId6"/>
+    embeds = [e.get(R+'embed') or e.get(R+'id') for e in p.iter(A+'blip', V+'imagedata')]
+    embeds = [e for e in embeds if e]
+    return ParagraphRecord.create(style, ''.join(texts), tuple(runs), tuple(embeds))
+
+  @staticmethod
+  def _toRunRecord(r: etree._Element) -> RunRecord:
+    text = ''
+    for child in r:
+      if child.tag in RUN_TEXT:
+        text += RUN_TEXT[child.tag] or child.text or ''
+      elif child.tag == W+'br' and child.get(W+'type', 'textWrapping') == 'textWrapping':
+        text += '\n'
+    return RunRecord(text, StreamPackage._onOff(r, 'b'), StreamPackage._onOff(r, 'i'))
+
+  @staticmethod
+  def _onOff(r: etree._Element, tag: str) -> bool:
+    """
+    <w:b/> is True, <w:b w:val="0"/> is False, no <w:b> at all is None
+    """
+    element = r.find(W+'rPr/'+W+tag)
+    if element is None:
+      return None
+    return element.get(W+'val', 'true') in ('1', 'true', 'on')
+
+  @classmethod
+  def paragraphText(cls, p: etree._Element) -> str:
+    """
+    Same text as ParagraphRecord.text, for paragraphs that do not need a ParagraphRecord, like the ones in a code block
+    """
+    texts = []
+    for child in p:
+      if child.tag == W+'r':
+        texts.append(cls._toRunRecord(child).text)
+      elif child.tag == W+'hyperlink':
+        texts += [cls._toRunRecord(r).text for r in child.iterchildren(W+'r')]
+    return ''.join(texts)
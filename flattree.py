@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import List, Tuple
+
+from node import Node, PhotoNode, MARKER_CODE
+
+# What a node is, in FlatTree.kind
+KIND_ROOT = 0
+KIND_HEADING = 1
+KIND_TEXT = 2
+KIND_CODE = 3
+# ®®0, a photo with its own note
+KIND_PHOTO = 4
+# ®®1, ®®2 ..., a photo shown on the notes of its level
+KIND_SHARED_PHOTO = 5
+
+
+def nodeKind(n: Node) -> int:
+  if isinstance(n, PhotoNode):
+    return KIND_SHARED_PHOTO if n.showOnChildrenLevel > 0 else KIND_PHOTO
+  if not n.context:
+    return KIND_ROOT
+  if n.context[0].marker == MARKER_CODE:
+    return KIND_CODE
+  if n.children or n.context[0].style.kind != 'normal':
+    return KIND_HEADING
+  return KIND_TEXT
+
+
+class FlatTree:
+  """
+  A Node tree as flat lists in pre-order ( a node, then its children ), built in 1 pass with a stack
+
+  - parent[i]: index of the parent of node i, -1 for root
+  - level[i]: same as nodes[i].level
+  - end[i]: 1 past the last node under node i, so the subtree of node i is range(i, end[i])
+  - kind[i]: KIND_HEADING, KIND_TEXT ...
+
+  The subtree of a node is a range of indices, and what every note gets from the headings above it
+  is 1 lookup by parent index, check noteMedia(), tags() and headingPaths().
+
+  Example:
+  ```python
+  tree = FlatTree(root)
+  media, tags = tree.noteMedia(), tree.tags()
+  ```
+  """
+  def __init__(self, root: Node):
+    nodes: List[Node] = []
+    parent: List[int] = []
+    stack = [(root, -1)]
+    while stack:
+      n, p = stack.pop()
+      index = len(nodes)
+      nodes.append(n)
+      parent.append(p)
+      if n.children:
+        # reversed, so the first child is popped first
+        stack.extend((c, index) for c in reversed(n.children))
+
+    # reverse pre-order reaches every node after all the nodes under it
+    end = list(range(1, len(nodes) + 1))
+    for i in range(len(nodes) - 1, 0, -1):
+      p = parent[i]
+      if end[i] > end[p]:
+        end[p] = end[i]
+
+    self.nodes = nodes
+    self.parent = parent
+    self.level = [n.level for n in nodes]
+    self.end = end
+    self.kind = [nodeKind(n) for n in nodes]
+
+  def __len__(self):
+    return len(self.nodes)
+
+  def ofKind(self, kind: int) -> List[int]:
+    """
+    Indices of all nodes of this kind, in document order
+    """
+    return [i for i, k in enumerate(self.kind) if k == kind]
+
+  def _byParent(self, values: list) -> list:
+    """
+    values[parent[i]] for each node i, and values[0] for root
+    """
+    return [values[0]] + [values[p] for p in self.parent[1:]]
+
+  def noteMedia(self) -> List[str]:
+    """
+    The <img> of each node: the ®®1, ®®2 ... photos of all the headings above it, or its own ®®0 photo
+
+    A shared photo is shown on every note under its parent heading, at any depth. Each heading's <img> are
+    built once, from its parent's and its own shared photos, then each node takes the ones of its parent.
+    """
+    own = {}
+    for i in self.ofKind(KIND_SHARED_PHOTO):
+      p = self.parent[i]
+      own[p] = own.get(p, '') + '<img src="' + self.nodes[i].imageName + '"><br>'
+
+    # only root and headings have children, the other nodes keep ''. A heading comes after its parent in pre-order
+    shown = [''] * len(self.nodes)
+    shown[0] = own.get(0, '')
+    for i in self.ofKind(KIND_HEADING):
+      shown[i] = shown[self.parent[i]] + own.get(i, '')
+    media = self._byParent(shown)
+    media[0] = ''
+    for i in self.ofKind(KIND_PHOTO):
+      media[i] = '<img src="' + self.nodes[i].imageName + '"><br>'
+    return media
+
+  def tags(self) -> List[Tuple[str, ...]]:
+    """
+    The tags of each node, which are the tags of its parent heading, same as Node.getAllParent()
+    """
+    tags = self._byParent([n.tagPath or () for n in self.nodes])
+    tags[0] = ()
+    return tags
+
+  def headingPaths(self) -> List[str]:
+    """
+    The heading path of each node: the text of every heading above it, from the top, each followed by a newline.
+    Unlike Node.getBranchStr(), it is the same on every OS, so it can go into note guids
+    """
+    paths = [''] * len(self.nodes)
+    for i in self.ofKind(KIND_HEADING):
+      paths[i] = paths[self.parent[i]] + self.nodes[i].context[0].text + '\n'
+    paths = self._byParent(paths)
+    paths[0] = ''
+    return paths
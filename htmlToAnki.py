@@ -1,23 +1,34 @@
 
 import xml.etree.ElementTree as ET
-from typing import List, Callable
-import io
+from typing import List, Callable, Iterator, TextIO, Tuple
+import argparse, io, os, sys, time, traceback
 
-from myanki import MyModel
-
-import genanki
+from manifest import Manifest, stableId, noteGuid
 
 
 def get_parent_hierarchy(node: ET.Element, **kwargs) -> List[str]:
     '''
     For each parent node, get the id attribute and return as a string
+
+    child_recursive() and stream_child_groups() already send the ids as parent_ids, built 1 node at a time
+    while going down, so they are not searched again for each group
+    '''
+    if 'parent_ids' in kwargs:
+        return list(kwargs['parent_ids'])
+    ids = ()
+    for n in kwargs.get('parent_nodes', []):
+        ids = add_parent_id(ids, n)
+    return list(ids)
+
+
+def add_parent_id(parent_ids: Tuple[str, ...], node: ET.Element) -> Tuple[str, ...]:
     '''
-    parent_nodes = kwargs.get('parent_nodes', [])
-    attrs = []
-    for n in parent_nodes:
-        if 'id' in n.attrib and n.attrib["id"] not in attrs:
-            attrs.append(n.attrib["id"])
-    return attrs
+    The ids of the parents of a child of node: parent_ids, then the id of node if it has a new one
+    '''
+    node_id = node.get('id')
+    if node_id is None or node_id in parent_ids:
+        return parent_ids
+    return parent_ids + (node_id,)
 
 
 def check_contain_attr(node_attr: str, attrs: List) -> bool:
@@ -31,46 +42,171 @@ def check_contain_attr(node_attr: str, attrs: List) -> bool:
 
 
 
-def child_recursive(node: ET.Element, parent_node_data: List, callback: Callable):
-     
-    simple_text_children, complex_element_children = [], []
+# Elements that are simple text, grouped together into 1 note
+SIMPLE_TEXT_TAGS = ['span', 'p', 'ul', 'ol', 'dt', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+# Elements with these classes will just stay as its, 1 note each
+COMPLEX_CLASSES = ['highlight-python3', 'highlight-pycon', 'doctest', 'describe', 'py method', 'py attribute', 'responsive-table__container', 'admonition']
 
-    for child in node:
-        # Group elements that are simple text together
-        if child.tag in ['span', 'p', 'ul', 'ol', 'dt', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-            simple_text_children.append(child)  
-        
-        # These elements will just stay as its, do not recursively go into them
-        elif child.attrib and 'class' in child.attrib and check_contain_attr(child.attrib['class'], ['highlight-python3', 'highlight-pycon', 'doctest', 'describe', 'py method', 'py attribute', 'responsive-table__container', 'admonition']):
-            complex_element_children.append(child)
-    
-    # Remowe the processed children to add a wrapper div for each
-    for child in simple_text_children + complex_element_children:
-        node.remove(child)
 
-    # Recursively go into each child
-    for child in node:
-        child_recursive(child, parent_node_data + [child], callback)
+def is_simple_text(child: ET.Element) -> bool:
+    return child.tag in SIMPLE_TEXT_TAGS
+
+
+def is_complex_element(child: ET.Element) -> bool:
+    return bool(child.attrib) and 'class' in child.attrib and check_contain_attr(child.attrib['class'], COMPLEX_CLASSES)
+
+
+def emit_groups(simple_text_children: List[ET.Element], complex_element_children: List[ET.Element], parent_nodes: List[ET.Element], callback: Callable, parent_ids: Tuple[str, ...] = None) -> List[ET.Element]:
+    '''
+    Wrap the simple text children of a node into 1 custom-group div, and each complex child into its own,
+    then call callback on each group, in that order
 
+    parent_ids are the ids of parent_nodes, see get_parent_hierarchy()
+
+    Returns the groups
+    '''
     # Group all simple text elements together, callback will process only that wrapper div, but also have all parents nodes
     group_div = ET.Element('div')
     group_div.attrib['class'] = 'custom-group'
     group_div.extend(simple_text_children)
-    callback(group_div, parent_nodes=parent_node_data + [node])
-    node.insert(0, group_div)
-    
+    if parent_ids is None:
+        parent_ids = tuple(get_parent_hierarchy(group_div, parent_nodes=parent_nodes))
+    callback(group_div, parent_nodes=parent_nodes, parent_ids=parent_ids)
+    groups = [group_div]
 
     for child in complex_element_children:
         group_div = ET.Element('div')
         group_div.attrib['class'] = 'custom-group'
         group_div.append(child)
-        callback(group_div, parent_nodes=parent_node_data + [node])
-        node.append(group_div)
+        callback(group_div, parent_nodes=parent_nodes, parent_ids=parent_ids)
+        groups.append(group_div)
+    return groups
+
+
+def child_recursive(node: ET.Element, parent_node_data: List, callback: Callable, parent_ids: Tuple[str, ...] = None):
+    '''
+    parent_ids are the ids of parent_node_data, computed from it when not given
+    '''
+    if parent_ids is None:
+        parent_ids = tuple(get_parent_hierarchy(node, parent_nodes=parent_node_data))
+    simple_text_children, complex_element_children, other_children = [], [], []
+
+    for child in node:
+        # Group elements that are simple text together
+        if is_simple_text(child):
+            simple_text_children.append(child)  
         
+        # These elements will just stay as its, do not recursively go into them
+        elif is_complex_element(child):
+            complex_element_children.append(child)
+
+        else:
+            other_children.append(child)
+    
+    # Remove the processed children to add a wrapper div for each, all at once
+    node[:] = other_children
+
+    # Recursively go into each child
+    for child in other_children:
+        child_recursive(child, parent_node_data + [child], callback, add_parent_id(parent_ids, child))
+
+    groups = emit_groups(simple_text_children, complex_element_children, parent_node_data + [node], callback, add_parent_id(parent_ids, node))
+    node.insert(0, groups[0])
+    node.extend(groups[1:])
+
 
+def stream_child_groups(file: TextIO, callback: Callable, chunk_size: int = 64 * 1024):
+    '''
+    Same callbacks, in the same order, as child_recursive() on the first <section> of a html page,
+    but the page is parsed chunk by chunk, without reading the whole file or writing any file
+
+    Each node's groups are sent to callback as soon as the node closes. Then the node is removed from the tree,
+    so only the open nodes and their grouped children are in memory.
+    Everything before the first <section and after it closes is skipped, like the header and footer.
+
+    with open('tmp.html', 'r', encoding='utf-8') as f:
+        stream_child_groups(f, callback)
+    '''
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    # Nodes that are open, and recursively gone into: [ node, parent_node_data, simple children, complex children, parent_ids ]
+    open_nodes = []
+    # > 0 while inside a simple or complex child, which is grouped as a whole
+    grouped_depth = 0
+
+    for chunk in _iter_from_section(file, chunk_size):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if grouped_depth:
+                grouped_depth += 1 if event == 'start' else -1
+                continue
+
+            if event == 'start':
+                if not open_nodes:
+                    open_nodes.append([element, [], [], [], ()])
+                elif is_simple_text(element):
+                    open_nodes[-1][2].append(element)
+                    grouped_depth = 1
+                elif is_complex_element(element):
+                    open_nodes[-1][3].append(element)
+                    grouped_depth = 1
+                else:
+                    open_nodes.append([element, open_nodes[-1][1] + [element], [], [], add_parent_id(open_nodes[-1][4], element)])
+                continue
+
+            node, parent_node_data, simple_text_children, complex_element_children, parent_ids = open_nodes.pop()
+            emit_groups(simple_text_children, complex_element_children, parent_node_data + [node], callback, add_parent_id(parent_ids, node))
+            if not open_nodes:
+                return
+
+            # The parser can be a few elements ahead, so the closed node is not always the last child
+            parent = open_nodes[-1][0]
+            for i in range(len(parent) - 1, -1, -1):
+                if parent[i] is node:
+                    del parent[i]
+                    break
+
+
+def _iter_from_section(file: TextIO, chunk_size: int) -> Iterator[str]:
+    '''
+    Read the file chunk by chunk, starting from the first <section
+    '''
+    start_tag = '<section '
+    buffer = ''
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        buffer += chunk
+        index = buffer.find(start_tag)
+        if index != -1:
+            yield buffer[index:]
+            break
+        # <section may be cut between 2 chunks
+        buffer = buffer[-len(start_tag):]
+
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+
+def node_to_anki(answers: List[str], table_of_contents: List[List[str]], output: str = None, manifest: Manifest = None, delta: bool = False):
+    '''
+    Write all the notes into 1 .apkg, 1 subdeck for each table of contents: PythonDocs::heading1::heading2
 
+    The JavaScript files are added only once, all notes share them
+
+    Deck ids come from the deck name, and note guids from the deck name and the position of the note in its deck,
+    so converting the docs again updates the same notes in Anki.
+    manifest records the notes of this run, with delta only the new or changed notes are written, check Manifest
+    '''
+    # genanki is only needed here, the worker processes of convert_site() never import it
+    import genanki
+    from ankimodel import MyModel
+    from apkgwriter import ApkgWriter
 
-def node_to_anki(answers: List[str], table_of_contents: List[List[str]]):
     filename = 'PythonDocs'
     css = open('pydoctheme.css').read()
     front_html =  '''
@@ -114,63 +250,170 @@ setTimeout(() => update(0.8), 50);
     decks = {}
     for t in table_of_contents:
         deck_name = f'{filename}::{"::".join(t)}'
-        decks[deck_name] = genanki.Deck(deck_id=abs(hash(deck_name)) % (10 ** 10), name=deck_name)
+        decks[deck_name] = genanki.Deck(deck_id=stableId(deck_name), name=deck_name)
 
     for i, ans in enumerate(answers):
         # HACK: Force import JavaScript file as image media on each card, so Anki will actually import it to collection
         media = '<img src="seedrandom.js" style="display:none"><img src="handlePyDocs.js" style="display:none">'
         table_of_content_html = ''.join([f'<h4>{t}</h4>' for t in table_of_contents[i]])
-        anki_note = genanki.Note(model=my_model, fields=[ans, answers[i], media, table_of_content_html], tags=['python-docs'])
         deck_name = f'{filename}::{"::".join(table_of_contents[i])}'
+        guid = noteGuid(deck_name, len(decks[deck_name].notes))
+        anki_note = genanki.Note(model=my_model, fields=[ans, answers[i], media, table_of_content_html], tags=['python-docs'], guid=guid)
         decks[deck_name].add_note(anki_note)
 
-    anki_output = genanki.Package(list(decks.values()))
-    anki_output.media_files = ['seedrandom.js', 'handlePyDocs.js']
-    anki_output.write_to_file(filename+'.apkg')
+    # genanki.Package rewrites the whole deck list for each deck, too slow with a subdeck for every section of a site
+    with ApkgWriter(output or filename+'.apkg') as anki_output:
+        for media_file in ['seedrandom.js', 'handlePyDocs.js']:
+            with open(media_file, 'rb') as f:
+                anki_output.addMedia(media_file, f.read())
+        for deck in decks.values():
+            anki_output.addDeck(deck)
+            for note in deck.notes:
+                if manifest and not manifest.addNote(note) and delta:
+                    continue
+                anki_output.addNote(note, deck)
+    if manifest:
+        manifest.save()
     
     
 
-def find_substring(phrase: str, substring: str):
-    index = phrase.find(substring)
-    return phrase[index:] if index != -1 else None
+class PageResult:
+    '''
+    Notes of 1 html page, and how long the page took
 
+    error is empty when the conversion worked, otherwise it has the traceback from the worker
+    '''
+    def __init__(self, filename: str, answers: List[str] = None, table_of_contents: List[List[str]] = None, seconds: float = 0.0, error: str = ''):
+        self.filename = filename
+        self.answers = answers or []
+        self.table_of_contents = table_of_contents or []
+        self.seconds = seconds
+        self.error = error
 
-def find_last_substring(phrase, substring):
-    index = phrase.rfind(substring)
-    return phrase[:index+len(substring)] if index != -1 else None
+    def __repr__(self):
+        if self.error:
+            return 'FAILED ' + self.filename + os.linesep + self.error
+        return '%8.0f ms  %6d notes  %s' % (self.seconds * 1000, len(self.answers), self.filename)
 
 
-if __name__ == '__main__':
-    with open('tmp.html', 'r', encoding='utf-8') as f:
-        html_str = f.read()
+class FragmentWriter:
+    '''
+    Callback for child_recursive() and stream_child_groups(): each group is serialized straight into
+    answers ( the note fields ), and its parent ids into table_of_contents
 
-        # Remove all the header and footer, only keep the main section
-        html_str = find_substring(html_str, '<section ')
-        html_str = find_last_substring(html_str, '</section>')
+    1 text buffer is reused for all the groups, instead of a new byte buffer, text wrapper and utf-8 decode for each
 
-        with open('out.html', 'w', encoding='utf-8') as f:
-            f.write(html_str)
+    fragments = FragmentWriter(['library', 'json'])
+    stream_child_groups(f, fragments)
+    node_to_anki(fragments.answers, fragments.table_of_contents)
+    '''
+    def __init__(self, deck_path: List[str] = None):
+        self.deck_path = deck_path or []
+        self.answers: List[str] = []
+        self.table_of_contents: List[List[str]] = []
+        self._buffer = io.StringIO()
 
-    # tree = ET.parse('tmp.html')
+    def serialize(self, node: ET.Element) -> str:
+        buffer = self._buffer
+        buffer.seek(0)
+        buffer.truncate()
+        ET.ElementTree(node).write(buffer, encoding='unicode')
+        return buffer.getvalue()
 
-    # answers: List[str] = []
-    # table_of_contents: List[List[str]] = []
-    # def callback(node, **kwargs):
-    #     # draw_boundary(node, **kwargs)
+    def __call__(self, node: ET.Element, **kwargs):
+        self.answers.append(self.serialize(node))
+        self.table_of_contents.append(self.deck_path + get_parent_hierarchy(node, **kwargs))
 
-    #     string_io = io.BytesIO()
-    #     ET.ElementTree(node).write(string_io, encoding='utf-8')
-    #     answers.append(string_io.getvalue().decode('utf-8'))
-    #     string_io.close()
-    
-    #     content = get_parent_hierarchy(node, **kwargs)
-    #     table_of_contents.append(content)
-        
-    
-    # child_recursive(tree.getroot(), [], callback)
 
-    # node_to_anki(answers, table_of_contents)
-    
-    # tree.write('out.html', encoding='utf-8')
+def convert_page(filename: str, deck_path: List[str] = None) -> PageResult:
+    '''
+    Worker: read 1 Sphinx html page into notes
+
+    deck_path goes in front of each table of contents, so pages of a site do not mix their subdecks
+    '''
+    start = time.perf_counter()
+    fragments = FragmentWriter(deck_path)
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            stream_child_groups(f, fragments)
+    except Exception:
+        return PageResult(filename, seconds=time.perf_counter() - start, error=traceback.format_exc())
+    return PageResult(filename, fragments.answers, fragments.table_of_contents, time.perf_counter() - start)
+
+
+def find_html_pages(directory: str) -> List[str]:
+    '''
+    All the content pages of a Sphinx html build, without _static, _sources, the index and the search page
+    '''
+    pages = []
+    for current, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('_', '.')))
+        for f in sorted(files):
+            if f.endswith('.html') and f not in ('genindex.html', 'search.html', 'py-modindex.html'):
+                pages.append(os.path.join(current, f))
+    return pages
+
 
+def page_deck_path(directory: str, page: str) -> List[str]:
+    '''
+    library/json.html -> ['library', 'json']
+    '''
+    return os.path.splitext(os.path.relpath(page, directory))[0].replace(os.sep, '/').split('/')
 
+
+def convert_site(directory: str, workers: int = None, output: str = None, manifest: Manifest = None, delta: bool = False) -> List[PageResult]:
+    '''
+    Convert every page of a Sphinx html build with a pool of worker processes, into 1 .apkg
+
+    All pages go under PythonDocs, 1 subdeck per page, then 1 per section: PythonDocs::library::json::basic-usage
+
+    A failed page does not stop the others, check PageResult.error.
+    Results are in the same order as the pages, which is also the order of the notes.
+    manifest and delta are passed to node_to_anki()
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    pages = find_html_pages(directory)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(convert_page, pages, [page_deck_path(directory, p) for p in pages], chunksize=4))
+
+    answers: List[str] = []
+    table_of_contents: List[List[str]] = []
+    for r in results:
+        answers += r.answers
+        table_of_contents += r.table_of_contents
+    if answers:
+        node_to_anki(answers, table_of_contents, output, manifest, delta)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert Sphinx html pages ( like the Python docs ) into an Anki .apkg file')
+    parser.add_argument('source', nargs='?', default='tmp.html', help='1 html page, or a whole Sphinx html build directory')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='with a directory, number of worker processes, default is number of CPUs')
+    parser.add_argument('-o', '--output', default='PythonDocs.apkg', help='the .apkg file')
+    parser.add_argument('--manifest', action='store_true', help='also write <output>.manifest.json, for the next --delta run')
+    parser.add_argument('--delta', action='store_true', help='only write the notes that are new or changed since the last --manifest or --delta run')
+    args = parser.parse_args()
+    manifest = Manifest(args.output + '.manifest.json') if args.manifest or args.delta else None
+
+    if os.path.isdir(args.source):
+        start = time.perf_counter()
+        page_results = convert_site(args.source, args.workers, args.output, manifest, args.delta)
+        # slowest pages first, so they stand out
+        for r in sorted(page_results, key=lambda r: r.seconds, reverse=True):
+            print(r)
+        failed = [r for r in page_results if r.error]
+        print(len(page_results) - len(failed), 'pages converted,', len(failed), 'failed,',
+              sum(len(r.answers) for r in page_results), 'notes in %.1f s' % (time.perf_counter() - start))
+        if manifest:
+            print(manifest.report())
+        sys.exit(1 if failed else 0)
+
+    # Only the main <section> is read, without the header and footer
+    page_result = convert_page(args.source)
+    if page_result.error:
+        print(page_result)
+        sys.exit(1)
+    node_to_anki(page_result.answers, page_result.table_of_contents, args.output, manifest, args.delta)
+    if manifest:
+        print(manifest.report())
@@ -0,0 +1,171 @@
+from __future__ import annotations
+import hashlib, io, os, time
+from typing import Dict, List, Tuple
+
+from node import Node, PhotoNode
+from mediastore import MediaStore
+from notecache import NoteCache
+
+
+# PIL format name -> file extension
+FORMATS = {'WEBP': '.webp', 'JPEG': '.jpg', 'PNG': '.png'}
+
+
+def shrinkImage(binary: bytes, maxSize: int, imageFormat: str, quality: int) -> Tuple[bytes, float, str]:
+  """
+  Resize an image to fit in maxSize x maxSize pixels ( keep aspect ratio, never enlarge ),
+  then save it as imageFormat with this quality.
+
+  Runs inside a worker process.
+
+  @return the new binary, how many seconds it took, and None.
+  Or None, the seconds, and the error when PIL cannot read the image ( SVG, EMF, WMF ... are common in Word documents )
+  """
+  # PIL is only needed here, and only with --shrink
+  from PIL import Image, UnidentifiedImageError
+  start = time.process_time()
+  try:
+    return _shrink(Image, binary, maxSize, imageFormat, quality), time.process_time() - start, None
+  except UnidentifiedImageError:
+    return None, time.process_time() - start, 'not an image format PIL can read'
+  except Exception as e:
+    return None, time.process_time() - start, type(e).__name__ + ': ' + str(e)
+
+
+def _shrink(Image, binary: bytes, maxSize: int, imageFormat: str, quality: int) -> bytes:
+  image = Image.open(io.BytesIO(binary))
+  image.thumbnail((maxSize, maxSize))
+  if imageFormat == 'JPEG' and image.mode not in ('RGB', 'L'):
+    # JPEG has no transparency, put the image on a white background
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.convert('RGBA'))
+    image = background
+  output = io.BytesIO()
+  image.save(output, imageFormat, quality=quality, optimize=True)
+  return output.getvalue()
+
+
+class ShrinkResult:
+  """
+  What happened to 1 image
+
+  when shrinking does not make the image smaller, the original is kept, and newName == name
+  when PIL cannot read the image, the original is kept too, and error says why
+  """
+  def __init__(self, name: str, newName: str, oldBytes: int, newBytes: int, seconds: float, cached: bool,
+               error: str = None):
+    self.name = name
+    self.newName = newName
+    self.oldBytes = oldBytes
+    self.newBytes = newBytes
+    self.seconds = seconds
+    self.cached = cached
+    self.error = error
+
+  def __repr__(self):
+    if self.error:
+      return self.name + ' : kept, ' + self.error
+    return self.name + ' -> ' + self.newName + ' : ' + str(self.oldBytes) + ' -> ' + str(self.newBytes) + ' bytes, ' \
+      + ('cached' if self.cached else '%.0f ms' % (self.seconds * 1000))
+
+
+class MediaShrinker:
+  """
+  Optional stage after the Node tree is built: make all images of a deck smaller, for faster Anki sync.
+
+  Images are processed by a pool of worker processes. A shrunk image is stored in the cache, keyed by
+  the hash of the original binary and the settings, so an image that did not change is never processed again.
+
+  Example:
+  ```python
+  media = MediaStore()
+  root = convertParagraphsToTree(package, media)
+  media = MediaShrinker(maxSize=1024, imageFormat='WEBP', quality=80, cache=NoteCache()).apply(root, media)
+  ```
+  """
+  def __init__(self, maxSize: int = 1600, imageFormat: str = 'WEBP', quality: int = 80, workers: int = None, cache: NoteCache = None):
+    self.maxSize = maxSize
+    self.imageFormat = imageFormat.upper()
+    if self.imageFormat not in FORMATS:
+      raise ValueError('Image format must be one of ' + ', '.join(FORMATS))
+    self.quality = quality
+    self.workers = workers
+    self.cache = cache
+    self.results: List[ShrinkResult] = []
+
+  def _cacheKey(self, binary: bytes) -> str:
+    settings = self.imageFormat + ':' + str(self.maxSize) + ':' + str(self.quality) + ':'
+    return 'shrink:' + settings + hashlib.sha1(binary).hexdigest()
+
+  def shrink(self, media: MediaStore) -> Tuple[MediaStore, Dict[str, str]]:
+    """
+    @return a new MediaStore with all images shrunk, and { old media name: new media name }
+    """
+    # name -> ( new binary, seconds, cached, error )
+    shrunk: Dict[str, Tuple[bytes, float, bool, str]] = {}
+    todo = []
+    for name, binary in media:
+      cached = self.cache.get(self._cacheKey(binary)) if self.cache else None
+      if cached is not None:
+        shrunk[name] = (cached, 0.0, True, None)
+      else:
+        todo.append((name, binary))
+
+    if len(todo) > 1 and self.workers != 1:
+      from concurrent.futures import ProcessPoolExecutor
+      with ProcessPoolExecutor(max_workers=self.workers) as pool:
+        outputs = pool.map(shrinkImage, [b for _, b in todo], [self.maxSize] * len(todo),
+                           [self.imageFormat] * len(todo), [self.quality] * len(todo))
+        outputs = list(outputs)
+    else:
+      outputs = [shrinkImage(b, self.maxSize, self.imageFormat, self.quality) for _, b in todo]
+
+    for (name, binary), (newBinary, seconds, error) in zip(todo, outputs):
+      if error:
+        # keep the original, and do not cache it, so it is tried again
+        shrunk[name] = (binary, seconds, False, error)
+        continue
+      if self.cache:
+        self.cache.put(self._cacheKey(binary), newBinary)
+      shrunk[name] = (newBinary, seconds, False, None)
+
+    newMedia, renames = MediaStore(), {}
+    self.results = []
+    for name, binary in media:
+      newBinary, seconds, cached, error = shrunk[name]
+      if len(newBinary) < len(binary):
+        newName = newMedia.add(os.path.splitext(name)[0] + FORMATS[self.imageFormat], newBinary)
+      else:
+        newName = newMedia.add(name, binary)
+      renames[name] = newName
+      self.results.append(ShrinkResult(name, newName, len(binary), len(newMedia.files[newName]), seconds, cached,
+                                       error))
+    return newMedia, renames
+
+  def apply(self, root: Node, media: MediaStore) -> MediaStore:
+    """
+    Shrink all images in media, and point every PhotoNode under root to its new image name
+
+    @return the new MediaStore
+    """
+    newMedia, renames = self.shrink(media)
+    stack = [root]
+    while stack:
+      n = stack.pop()
+      if isinstance(n, PhotoNode):
+        n.imageName = renames.get(n.imageName, n.imageName)
+      stack += n.children
+    return newMedia
+
+  def report(self) -> str:
+    """
+    1 line per image, then the total
+    """
+    oldBytes = sum(r.oldBytes for r in self.results)
+    newBytes = sum(r.newBytes for r in self.results)
+    lines = [repr(r) for r in self.results]
+    failed = sum(1 for r in self.results if r.error)
+    lines.append('Images: ' + str(len(self.results)) + ', ' + str(oldBytes) + ' -> ' + str(newBytes)
+                 + ' bytes, saved ' + str(oldBytes - newBytes) + ' bytes'
+                 + (', ' + str(failed) + ' kept because they cannot be read' if failed else ''))
+    return os.linesep.join(lines)
@@ -0,0 +1,121 @@
+from __future__ import annotations
+import hashlib, json, os, re
+from typing import TYPE_CHECKING, Dict, List, Set
+
+if TYPE_CHECKING:
+  import genanki
+
+
+MEDIA_SRC = re.compile(r'<img src="([^"]*)"')
+
+
+def stableId(*parts: str) -> int:
+  """
+  An Anki id from the sha1 of parts, the same in every run, unlike hash() which changes with each Python process
+
+  Example:
+  stableId('Document.docx')
+  >>> 4016074609
+  """
+  return int(hashlib.sha1('\x00'.join(parts).encode('utf-8')).hexdigest(), 16) % (10 ** 10)
+
+
+def uploadName(docx: bytes) -> str:
+  """
+  A deck name for a .docx that came without a filename, from its sha1, so 2 different documents never share
+  deck ids and note guids, check stableId() and noteGuid()
+  """
+  return hashlib.sha1(docx).hexdigest()[:16] + '.docx'
+
+
+def noteGuid(*parts) -> str:
+  """
+  The guid of a note, from where it is in the document instead of from its fields ( genanki's default ).
+  When the text of a note changes, Anki updates the old note and keeps its review history.
+  """
+  from genanki import guid_for
+  return guid_for('docx2anki', *parts)
+
+
+class Manifest:
+  """
+  What the last run wrote into its .apkg: { note guid: hash of its fields and tags } and { media name: hash }
+
+  With it, only the new and changed notes can be written, so importing into Anki stays small and fast.
+  Anki finds the old notes by guid and updates them.
+  The manifest is only saved after the .apkg is written, so a failed run does not lose any change.
+
+  Example:
+  ```python
+  manifest = Manifest('Document.docx.apkg.manifest.json')
+  docxToAnkiNotes('Document.docx', manifest=manifest, delta=True)
+  print(manifest.report())
+  ```
+  """
+  VERSION = 1
+
+  def __init__(self, filename: str):
+    self.filename = filename
+    self.previousNotes: Dict[str, str] = {}
+    self.previousMedia: Dict[str, str] = {}
+    self.notes: Dict[str, str] = {}
+    self.media: Dict[str, str] = {}
+    self.changedMedia: Set[str] = set()
+    self.changed = 0
+    self.unchanged = 0
+    if os.path.exists(filename):
+      with open(filename, encoding='utf-8') as f:
+        saved = json.load(f)
+      if saved.get('version') == self.VERSION:
+        self.previousNotes, self.previousMedia = saved['notes'], saved['media']
+
+  @staticmethod
+  def noteDigest(note: genanki.Note) -> str:
+    h = hashlib.sha1()
+    for value in note.fields:
+      h.update(value.encode('utf-8') + b'\x1f')
+    h.update(' '.join(note.tags).encode('utf-8'))
+    return h.hexdigest()
+
+  def addMedia(self, name: str, binary: bytes) -> bool:
+    """
+    @return True if this media file is new or changed since the last run
+    """
+    digest = hashlib.sha1(binary).hexdigest()
+    self.media[name] = digest
+    if self.previousMedia.get(name) == digest:
+      return False
+    self.changedMedia.add(name)
+    return True
+
+  def addNote(self, note: genanki.Note) -> bool:
+    """
+    @return True if this note is new or changed since the last run, or shows a changed image
+    """
+    digest = self.noteDigest(note)
+    self.notes[note.guid] = digest
+    if self.previousNotes.get(note.guid) == digest and not self.mediaOf(note) & self.changedMedia:
+      self.unchanged += 1
+      return False
+    self.changed += 1
+    return True
+
+  @staticmethod
+  def mediaOf(note: genanki.Note) -> Set[str]:
+    return {name for value in note.fields for name in MEDIA_SRC.findall(value)}
+
+  def removed(self) -> List[str]:
+    """
+    Guids of the last run that are not in this run. Anki cannot delete notes on import, they must be deleted there
+    """
+    return [guid for guid in self.previousNotes if guid not in self.notes]
+
+  def save(self):
+    temporary = self.filename + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+      json.dump({'version': self.VERSION, 'notes': self.notes, 'media': self.media}, f)
+    os.replace(temporary, self.filename)
+
+  def report(self) -> str:
+    return 'Manifest: ' + str(self.changed) + ' new or changed notes, ' + str(self.unchanged) + ' unchanged, ' \
+      + str(len(self.removed())) + ' removed, ' + str(len(self.changedMedia)) + ' new or changed images'
@@ -0,0 +1,50 @@
+from __future__ import annotations
+import hashlib, os
+from typing import Dict
+
+
+class MediaStore:
+  """
+  Keep all media files of a deck in memory, as { Anki media name: binary }
+
+  The images inside a docx are added byte for byte, without decoding them.
+  The same binary is only stored once, even if it comes with different names.
+
+  Example:
+  ```python
+  media = MediaStore()
+  media.add('image1.png', b'...')
+  >>> 'image1.png'
+  media.add('image7.png', b'...')   # same binary as image1.png
+  >>> 'image1.png'
+  media.add('image1.png', b',,,')   # different binary, name already used
+  >>> 'image1_5ab3c2d1.png'
+  ```
+  """
+  def __init__(self):
+    self.files: Dict[str, bytes] = {}
+    self.names: Dict[str, str] = {}
+
+  def add(self, name: str, binary: bytes) -> str:
+    """
+    @return the media name to use in the Anki note, which can be different from name
+    """
+    digest = hashlib.sha1(binary).hexdigest()
+    if digest in self.names:
+      return self.names[digest]
+    if name in self.files:
+      stem, ext = os.path.splitext(name)
+      name = stem + '_' + digest[:8] + ext
+    self.files[name] = binary
+    self.names[digest] = name
+    return name
+
+  def __len__(self):
+    return len(self.files)
+
+  def __iter__(self):
+    return iter(self.files.items())
+
+  def totalBytes(self) -> int:
+    return sum(len(b) for b in self.files.values())
+
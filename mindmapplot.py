@@ -1,68 +1,139 @@
 from __future__ import annotations
+import argparse
 from typing import List
+from xml.sax.saxutils import escape
 
-class Node():
-  def __init__(self, name: str, level=0):
-    self.name = name
-    self.y = 0
-    self.level = level
-    self.children = []
-  
-  def add(self, new_node: Node):
-    new_node.level = self.level+1
-    self.children.append(new_node)
-  
-  def __repr__(self):
-    results = '-'*self.level + ' ' + self.name + ' y: ' + str(self.y)
-    #for c in self.children:
-    #  results += repr(c)
-    return results
-
-
-root = Node('root', 0)
-for i in range(1,5,1):
-  ni = Node(str(i), 1)
-  for j in range(1,4,1):
-    nj = Node(str(i)+' '+str(j), 2)
-    for k in range(1,3,1):
-      nk = Node(str(i)+' '+str(j)+' '+str(k), 3)
-      nj.add(nk)
-    ni.add(nj)
-  root.add(ni)
-
-
-def _get_list_of_nodes(n: Node, list_of_nodes: List[Node]):
-  lst = [n]
-  for c in n.children:
-    lst += _get_list_of_nodes(c, [])
-  return list_of_nodes + lst
-
-
-def calc_y(list_of_nodes: List[Node]):
-  # find max level
-  maxLevel = 0
-  for n in list_of_nodes:
-    if n.level > maxLevel:
-      maxLevel = n.level
-  
-  # update the most bottom level of nodes first
-  maxLevelNodes = []
-  for n in list_of_nodes:
-    if n.level == maxLevel:
-      maxLevelNodes += [n]
-  
-  for i in range(len(maxLevelNodes)):
-    maxLevelNodes[i].y = 0 if i <= 0 else maxLevelNodes[i-1].y + 1
-  
-  # from max level to root
-  for i in range(maxLevel-1,-1,-1):
-    # for each node from list_of_nodes
-    for j in range(len(list_of_nodes)):
-      # check if current level
-      if list_of_nodes[j].level == i:
-        list_of_nodes[j].y = list_of_nodes[j].children[0].y
-
-
-
-list_of_nodes = _get_list_of_nodes(root, [])
-calc_y(list_of_nodes)
+from node import Node, PhotoNode
+
+
+class MindMapLayout:
+  """
+  Where each node of a document goes in a mind map: x is the level, y is a row
+
+  Leaves are stacked 1 row each, in document order, and each parent is centered over its first and last child.
+  The nodes are kept in pre-order ( a node, then its children ), in lists, because Node has __slots__.
+
+  Example:
+  ```python
+  root = convertParagraphsToTree(StreamPackage('Document.docx'))
+  layout = layoutTree(root, maxDepth=3)
+  open('Document.svg', 'w').write(layout.toSvg())
+  ```
+  """
+  def __init__(self, nodes: List[Node], parents: List[int], levels: List[int], y: List[float]):
+    self.nodes = nodes
+    # index of the parent of each node in nodes, -1 for root
+    self.parents = parents
+    self.levels = levels
+    self.y = y
+
+  def __len__(self):
+    return len(self.nodes)
+
+  @property
+  def rows(self) -> int:
+    return int(max(self.y, default=0)) + 1
+
+  @property
+  def depth(self) -> int:
+    return max(self.levels, default=0) + 1
+
+  @staticmethod
+  def label(n: Node, maxLength: int = 40) -> str:
+    if isinstance(n, PhotoNode):
+      return '[' + (n.imageName or 'picture') + ']'
+    if not n.context:
+      return 'root'
+    text = n.context[0].text
+    return text if len(text) <= maxLength else text[:maxLength - 1] + '…'
+
+  def toSvg(self, title: str = None, rowHeight: int = 18, columnWidth: int = 220, fontSize: int = 12) -> str:
+    """
+    1 text per node, and a curve from each parent to each child
+    """
+    def xy(i):
+      return 10 + self.levels[i] * columnWidth, 10 + (self.y[i] + 0.5) * rowHeight
+
+    width, height = 20 + self.depth * columnWidth, 20 + self.rows * rowHeight
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d" font-family="sans-serif" '
+             'font-size="%d">\n<rect width="100%%" height="100%%" fill="white"/>\n' % (width, height, width, height, fontSize),
+             '<g fill="none" stroke="#8ab" stroke-width="1">\n']
+    for i, p in enumerate(self.parents):
+      if p < 0:
+        continue
+      (x0, y0), (x1, y1) = xy(p), xy(i)
+      # from the end of the parent column to the start of the child text
+      x0 += columnWidth - 30
+      middle = (x0 + x1) / 2
+      parts.append('<path d="M%.0f %.1fC%.0f %.1f %.0f %.1f %.0f %.1f"/>\n' % (x0, y0, middle, y0, middle, y1, x1 - 4, y1))
+    parts.append('</g>\n<g fill="#222" dominant-baseline="middle">\n')
+    for i, n in enumerate(self.nodes):
+      x, y = xy(i)
+      text = title if i == 0 and title else self.label(n)
+      weight = ' font-weight="bold"' if n.children else ''
+      parts.append('<text x="%.0f" y="%.1f"%s>%s</text>\n' % (x, y, weight, escape(text)))
+    parts.append('</g>\n</svg>\n')
+    return ''.join(parts)
+
+
+def layoutTree(root: Node, maxDepth: int = None) -> MindMapLayout:
+  """
+  Lay out a Node tree in 2 linear passes, with a stack instead of recursion
+
+  1. pre-order: list the nodes, their parent and level, and give each leaf the next row
+  2. reverse pre-order, which reaches every child before its parent: each parent goes to the middle of
+     its first and last child
+
+  :maxDepth:: only the nodes up to this many levels under root, deeper nodes are left out
+  """
+  nodes: List[Node] = []
+  parents: List[int] = []
+  levels: List[int] = []
+  y: List[float] = []
+  row = 0
+  stack = [(root, -1, 0)]
+  while stack:
+    n, parent, level = stack.pop()
+    index = len(nodes)
+    nodes.append(n)
+    parents.append(parent)
+    levels.append(level)
+    if n.children and (maxDepth is None or level < maxDepth):
+      y.append(-1.0)
+      # reversed, so the first child is popped first
+      stack.extend((c, index, level + 1) for c in reversed(n.children))
+    else:
+      y.append(float(row))
+      row += 1
+
+  first = [-1.0] * len(nodes)
+  last = [-1.0] * len(nodes)
+  for i in range(len(nodes) - 1, -1, -1):
+    if y[i] < 0:
+      y[i] = (first[i] + last[i]) / 2
+    p = parents[i]
+    if p >= 0:
+      # children are reached last one first, so the last one seen is the first child
+      first[p] = y[i]
+      if last[p] < 0:
+        last[p] = y[i]
+  return MindMapLayout(nodes, parents, levels, y)
+
+
+def documentSvg(root: Node, title: str = None, maxDepth: int = None) -> str:
+  return layoutTree(root, maxDepth).toSvg(title)
+
+
+if __name__ == '__main__':
+  from docxstream import StreamPackage
+  from docx2tree import convertParagraphsToTree
+
+  parser = argparse.ArgumentParser(description='Draw the headings and lines of a .docx as a mind map, in an .svg file')
+  parser.add_argument('filename', help='the .docx file')
+  parser.add_argument('-o', '--output', default=None, help='the .svg file, default is next to the .docx')
+  parser.add_argument('--depth', type=int, default=None, help='only this many levels under the document')
+  args = parser.parse_args()
+
+  root = convertParagraphsToTree(StreamPackage(args.filename))
+  with open(args.output or args.filename + '.svg', 'w', encoding='utf-8') as f:
+    f.write(documentSvg(root, args.filename, args.depth))
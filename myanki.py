@@ -1,111 +1,237 @@
 from __future__ import annotations
-import genanki
-import hashlib, os, sys
-from pathlib import Path
-from typing import List, Tuple, Dict
-
-from docx.package import Package, OpcPackage
-from docx.text.paragraph import Paragraph
-from docx.table import Table
+import argparse, functools, io, itertools, os, sys, warnings
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterator, List, Tuple, Union
 
+# genanki, python-docx and PIL take most of the startup time, they are imported by the stage that needs them
 from docx2tree import Node, PhotoNode, DocxToNode
+from node import ParagraphRecord, MARKER_CODE
+from codeblocks import CodeBlockIndex
+from flattree import FlatTree
 from docx2tree import convertParagraphsToTree
+from docxstream import StreamPackage, ParagraphMemo
+from notecache import NoteCache
+from manifest import Manifest, stableId, noteGuid, uploadName
+from mediastore import MediaStore
+from imageshrink import MediaShrinker
+from profiling import Profiler, NO_PROFILER
+
+if TYPE_CHECKING:
+  import genanki
+  from apkgwriter import ApkgWriter
 
 
-def docxToAnkiNotes(filename: str):
+def docxToAnkiNotes(filename: str, outputFilename: str = None, cache: NoteCache = None, stream: bool = False, shrinker: MediaShrinker = None,
+                    profiler: Profiler = NO_PROFILER, manifest: Manifest = None, delta: bool = False, mindMap: bool = False,
+                    namespace: str = None, memo: ParagraphMemo = None):
+  """
+  Convert a .docx file into a .apkg file, next to it ( or at outputFilename )
+
+  cache keeps the paragraphs of the document and the shrunk images between runs, check NoteCache
+  stream reads the document with StreamPackage instead of python-docx, faster on big documents
+  shrinker makes all images smaller before they go into the deck, check MediaShrinker
+  profiler collects stage timers and counters of this run, check profiling.py
+  manifest records the notes and images of this run, and is saved after the .apkg is written.
+  With delta, only the notes and images that are new or changed since the manifest's last run go into the .apkg
+  mindMap adds a note with an .svg mind map of the whole document, check mindmapplot.py
+  namespace sets the deck id, the model and the note guids, check iterDocxNotes()
+  memo keeps the paragraphs of this run, so the next run only converts the changed ones, check ParagraphMemo
+
+  Notes are written into the .apkg as soon as they are created, the deck is never kept in memory
+  """
+  if delta and manifest is None:
+    raise ValueError('delta needs the manifest of the last run')
+  from apkgwriter import ApkgWriter
+  profiler.start()
   try:
-    f = open(filename, 'rb')
-    pp = Package.open(f)
-    f.close()
-  except:
-    print("Cannot open ", filename, "Must be a .docx file.")
+    my_deck, media, notes = iterDocxNotes(filename, cache, stream, shrinker, profiler, mindMap=mindMap, namespace=namespace,
+                                          memo=memo)
 
-  root = convertParagraphsToTree(pp)
+    with profiler.stage('write'), ApkgWriter(outputFilename or filename+'.apkg') as anki_output:
+      writeApkg(anki_output, my_deck, media, notes, profiler, manifest, delta)
+    if manifest:
+      manifest.save()
+  finally:
+    profiler.stop()
 
-  my_model = MyModel(filename+' Model', fields=[{'name': 'Question'}, {'name': 'Answer'}, {
-      'name': 'Media'}, {'name': 'TableOfContent'}])
 
-  notes = NodeToAnki.createAnkiNotes(root, my_model, pp)
+class ConversionResult:
+  """
+  The .apkg of 1 conversion, as bytes, and what happened: profiler.report() with the stage timers, counters
+  ( notes, images, paragraphs... ) and apkgBytes
+  """
+  def __init__(self, name: str, apkg: bytes, stats: dict):
+    self.name = name
+    self.apkg = apkg
+    self.stats = stats
 
-  my_deck = genanki.Deck(deck_id=abs(hash(filename)) % (10 ** 10), name=filename)
+  def __repr__(self):
+    return self.name + ': ' + str(self.stats['counters'].get('notes', 0)) + ' notes, ' \
+      + str(len(self.apkg)) + ' bytes in %.0f ms' % (self.stats['totalSeconds'] * 1000)
 
-  for n in notes:
-    my_deck.add_note(n)
 
-  img_path = Path(r'image').glob('**/*')
-  images = ['image/'+x.name for x in img_path if x.is_file()]
+def docxToApkgBytes(docx: Union[bytes, BinaryIO], name: str = None, cache: NoteCache = None, stream: bool = False,
+                    shrinker: MediaShrinker = None, timestamp: float = None) -> ConversionResult:
+  """
+  Convert a .docx, as bytes or a binary file object, into a .apkg in memory. No file is read or written
+
+  name is the deck name, like the filename for docxToAnkiNotes(). The notes are the same as for a file with that name.
+  Without a name, the name comes from the sha1 of the .docx, check uploadName()
+  Each call has its own state, so many conversions can run at once from a thread pool.
+  A cache or a shrinker ( which has a cache, and its last results ) must not be shared between threads.
+
+  Example:
+  ```python
+  with ThreadPoolExecutor() as pool:
+    results = list(pool.map(docxToApkgBytes, uploads, names))
+  results[0].apkg
+  >>> b'PK...'
+  ```
+  """
+  from apkgwriter import ApkgWriter
+  if name is None:
+    docx = docx if isinstance(docx, (bytes, bytearray, memoryview)) else docx.read()
+    name = uploadName(docx)
+  source = io.BytesIO(docx) if isinstance(docx, (bytes, bytearray, memoryview)) else docx
+  output = io.BytesIO()
+  profiler = Profiler()
+  profiler.start()
+  try:
+    my_deck, media, notes = iterDocxNotes(source, cache, stream, shrinker, profiler, name)
+    with profiler.stage('write'), ApkgWriter(output, timestamp, inMemory=True) as anki_output:
+      writeApkg(anki_output, my_deck, media, notes, profiler)
+  finally:
+    profiler.stop()
+  apkg = output.getvalue()
+  profiler.count('apkgBytes', len(apkg))
+  return ConversionResult(name, apkg, profiler.report())
+
+
+def writeApkg(anki_output: ApkgWriter, my_deck: genanki.Deck, media: MediaStore, notes: Iterator[genanki.Note],
+              profiler: Profiler = NO_PROFILER, manifest: Manifest = None, delta: bool = False):
+  """
+  Add the deck, its images and its notes into anki_output, check docxToAnkiNotes() for manifest and delta
+  """
+  anki_output.addDeck(my_deck)
+  added = set()
+  for name, binary in media:
+    changed = manifest.addMedia(name, binary) if manifest else True
+    if changed or not delta:
+      anki_output.addMedia(name, binary)
+      added.add(name)
+  for n in profiler.iterate('notes', notes):
+    changed = manifest.addNote(n) if manifest else True
+    if not changed and delta:
+      profiler.count('unchangedNotes')
+      continue
+    anki_output.addNote(n, my_deck)
+    if delta:
+      # an unchanged image is not in the delta .apkg, unless a new or changed note shows it
+      for name in Manifest.mediaOf(n) - added:
+        if name in media.files:
+          anki_output.addMedia(name, media.files[name])
+          added.add(name)
+
+
+def docxToAnkiDeck(filename: str, cache: NoteCache = None, stream: bool = False, shrinker: MediaShrinker = None,
+                   profiler: Profiler = NO_PROFILER, namespace: str = None) -> Tuple[genanki.Deck, MediaStore]:
+  """
+  Convert a .docx file into an Anki deck, without writing any file, check iterDocxNotes() for namespace
 
-  anki_output = genanki.Package(my_deck)
-  anki_output.media_files = images
-  anki_output.write_to_file(filename+'.apkg')
+  @return the deck, and all the images the deck needs
+  """
+  profiler.start()
+  try:
+    my_deck, media, notes = iterDocxNotes(filename, cache, stream, shrinker, profiler, namespace=namespace)
+    for n in profiler.iterate('notes', notes):
+      my_deck.add_note(n)
+  finally:
+    profiler.stop()
+  return my_deck, media
+
+
+def iterDocxNotes(filename: Union[str, BinaryIO], cache: NoteCache = None, stream: bool = False, shrinker: MediaShrinker = None,
+                  profiler: Profiler = NO_PROFILER, name: str = None, mindMap: bool = False, namespace: str = None,
+                  memo: ParagraphMemo = None) \
+    -> Tuple[genanki.Deck, MediaStore, Iterator[genanki.Note]]:
+  """
+  Read a .docx file into a Node tree, the notes are only created while looping over them
 
+  filename can also be a binary file object, then name is the deck name
+  mindMap: the first note shows an .svg mind map of the document, added to the images
+  namespace: the deck id, the model id and every note guid come from it, so 2 documents must not share it.
+  Default is the file name without its folder, so doc.docx and ./doc.docx are the same deck.
+  When documents with the same file name are in different folders, like batch.py does, give their path
+  from a fixed root folder instead, like 'a/x.docx' and 'b/x.docx'
+  memo: the paragraphs with the same xml as in the memo's last read are not converted again, check ParagraphMemo
 
-class MyModel(genanki.Model):
+  @return an empty deck for the notes, all the images the deck needs, and the notes
   """
-  Customize how all Anki Notes will look like in this Anki Model.
+  name = name or filename
+  try:
+    with profiler.stage('open'):
+      # with a cache or a memo, the paragraphs may come from it, StreamPackage only reads them when asked
+      if stream or cache or memo:
+        pp = StreamPackage(filename)
+      else:
+        from docx.package import Package
+        if hasattr(filename, 'read'):
+          pp = Package.open(filename)
+        else:
+          f = open(filename, 'rb')
+          pp = Package.open(f)
+          f.close()
+  except:
+    print("Cannot open ", name, "Must be a .docx file.")
+    raise
+
+  media, codeBlocks = MediaStore(), CodeBlockIndex()
+  with profiler.stage('tree'):
+    paragraphs = None
+    if cache:
+      key = pp.signature()
+      paragraphs = cache.getParagraphs(key, codeBlocks)
+      if paragraphs is None:
+        paragraphs = list(pp.iterParagraphs(codeBlocks, memo))
+        cache.putParagraphs(key, paragraphs, codeBlocks)
+    elif memo:
+      paragraphs = pp.iterParagraphs(codeBlocks, memo)
+    root = convertParagraphsToTree(pp, media, codeBlocks, profiler, paragraphs)
+  if shrinker:
+    with profiler.stage('shrink'):
+      media = shrinker.apply(root, media)
+  profiler.count('images', len(media))
+  profiler.count('mediaBytes', media.totalBytes())
+
+  import genanki
+  from ankimodel import MyModel
+  namespace = namespace or os.path.basename(name)
+  my_model = MyModel(namespace+' Model', fields=[{'name': 'Question'}, {'name': 'Answer'}, {
+      'name': 'Media'}, {'name': 'TableOfContent'}])
 
-  Also, create a hash for this Model, for Anki app to track future Notes update.
-  """
-  DefaultFrontTemplate = '''
-  <div class="front">{{TableOfContent}}<br><br>{{Question}}</div>
-  '''
-
-  DefaultBackTemplate = '''
-  <div class="back">
-  <table style="width:100%">
-    <tr>
-      <th>{{TableOfContent}}</th>
-    </tr>
-    <tr>
-      <th>{{Answer}}</th>
-    </tr>
-    <tr>
-      <th>{{Media}}</th>
-    </tr>
-  </table>
-  </div>
-
-  </div>
-  '''
-
-  DefaultStyle = '''
-  .card {
-    font-family: 'DejaVu Sans Mono';
-    text-align: left;
-    color: white;
-    background-color: rgba(42, 129, 151,1);
-    text-shadow: 0px 4px 3px rgba(0,0,0,0.4),
-                0px 8px 13px rgba(0,0,0,0.1),
-                0px 18px 23px rgba(0,0,0,0.1);
-  }
-
-  .front {
-    font-size: 20px;
-  }
-
-  .back {
-    font-size: 20px;
-  }
-
-  th {
-      height:200px
-      width:auto;/*maintain aspect ratio*/
-      max-width:500px;
-  }
-
-  @font-face { font-family: DejaVu Sans Mono; src: url('_DejaVuSansMono.ttf'); }
-  '''
-  
-  def __init__(self, name: str, fields: List, front_html=DefaultFrontTemplate, back_html=DefaultBackTemplate, css= DefaultStyle):
-    hash_object = hashlib.sha1(name.encode('utf-8'))
-    hex_dig = int(hash_object.hexdigest(), 16) % (10 ** 10)
-    
-    templates = [{
-        'name': 'Card 1',
-        'qfmt': front_html,
-        'afmt': back_html,
-      }]
-    super(MyModel, self).__init__(model_id=hex_dig, name=name, fields=fields, templates=templates, css=css)
+  # The Node tree has its own copy of the paragraphs, the docx can be freed before creating notes
+  del pp
+
+  my_deck = genanki.Deck(deck_id=stableId(namespace), name=name)
+  notes = NodeToAnki.iterAnkiNotes(root, my_model, codeBlocks, profiler, namespace)
+
+  if mindMap:
+    from mindmapplot import documentSvg
+    title = os.path.basename(name)
+    with profiler.stage('mindmap'):
+      svgName = media.add(title + '.mindmap.svg', documentSvg(root, title).encode('utf-8'))
+    mindMapNote = genanki.Note(model=my_model, fields=['Mind map', 'Mind map', '<img src="' + svgName + '"><br>',
+                               NodeToAnki.tableOfContentHtml(root.tocPath or '')], guid=noteGuid(namespace, 'mind map'))
+    notes = itertools.chain([mindMapNote], notes)
+
+  return my_deck, media, notes
+
+
+def __getattr__(name: str):
+  # MyModel moved to ankimodel, so importing myanki does not import genanki
+  if name == 'MyModel':
+    from ankimodel import MyModel
+    return MyModel
+  raise AttributeError("module 'myanki' has no attribute " + repr(name))
 
 
 class NodeToAnki:
@@ -114,120 +240,175 @@ class NodeToAnki:
     """
     Replace space and nextline character to HTML entity
     """
+    # 3 replace() are faster than 1 str.translate() with a table, which looks up every character in a dict
     return text.replace(os.linesep, '<br>').replace('\t', '&ensp;&ensp;').replace(' ', '&ensp;')
-  
+
   @staticmethod
-  def convertParagraphToHtml(para: Paragraph, hideBold: bool) -> str:
+  @functools.lru_cache(maxsize=1024)
+  def tableOfContentHtml(branchStr: str) -> str:
     """
-    Convert Node text to HTML format, where Anki can read.
+    unicodeToHTMLEntities() of a heading path. All the lines under a heading have the same path, it is converted once
+    """
+    return NodeToAnki.unicodeToHTMLEntities(branchStr)
 
-    :para:: python-docx Paragraph. Like a sentence
-    :hideBold:: If true, all the bold/italic text will all turn into _
+  @staticmethod
+  def renderParagraphs(paragraphs: List[ParagraphRecord]) -> Tuple[str, str]:
     """
-    result = ''
-    if not DocxToNode.isNormalParagraph(para) or DocxToNode.isEmptyParagraph(para):
-      return ''
-    for r in para.runs:
-      if r.bold:
-        result += '<b>' + ('_' * len(r.text) if hideBold else r.text) + '</b>'
-      elif r.italic:
-        result += '<i>' + ('_' * len(r.text) if hideBold else r.text) + '</i>'
-      else:
-        result += r.text
-    return result
+    The question and the answer html of some paragraphs, 1 pass over the runs for both
+
+    Adjacent runs with the same formatting become 1 tag: Word often splits a sentence into many runs
+    ( spell check, edit history ), <b>He</b><b>llo</b> is rendered <b>Hello</b>.
+    In the question, bold and italic text becomes _, 1 per character.
+    Each paragraph ends with <br>, headings, pictures and empty paragraphs are only a <br>.
+    """
+    question = answer = ''
+    for p in paragraphs:
+      if p.style.kind == 'normal' and not p.empty:
+        # tag of the runs not written yet: b for bold ( even if also italic ), i for italic, '' for plain text
+        tag, text = None, ''
+        for r in p.runs:
+          runTag = 'b' if r.bold else 'i' if r.italic else ''
+          if runTag == tag:
+            text += r.text
+            continue
+          if tag:
+            answer += '<' + tag + '>' + text + '</' + tag + '>'
+            question += '<' + tag + '>' + '_' * len(text) + '</' + tag + '>'
+          elif tag is not None:
+            answer += text
+            question += text
+          tag, text = runTag, r.text
+        if tag:
+          answer += '<' + tag + '>' + text + '</' + tag + '>'
+          question += '<' + tag + '>' + '_' * len(text) + '</' + tag + '>'
+        else:
+          answer += text
+          question += text
+      answer += '<br>'
+      question += '<br>'
+    return question, answer
 
   @staticmethod
-  def getAnkiNoteFields(node: Node) -> Tuple[str, str, str]:
+  def getAnkiNoteFields(node: Node, profiler: Profiler = NO_PROFILER) -> Tuple[str, str, str]:
     """
     Convert Node object into Anki note fields, for Anki note card
     """
-    question, answer = '', ''
-    tableOfContent = NodeToAnki.unicodeToHTMLEntities(node.getBranchStr())
+    branchStr = node.getBranchStr()
+    with profiler.stage('toc'):
+      tableOfContent = NodeToAnki.tableOfContentHtml(branchStr)
     # So Document can save a line into multiple context, this is to add them all. 
     # For example: "This is <bold>one</bold> line" has 3 contexts
-    for p in node.context:
-      question += NodeToAnki.convertParagraphToHtml(p, True) + '<br>'
-      answer += NodeToAnki.convertParagraphToHtml(p, False) + '<br>'
+    with profiler.stage('html'):
+      question, answer = NodeToAnki.renderParagraphs(node.context)
     return (question, answer, tableOfContent)
   
   @classmethod
-  def createAnkiNotes(cls, root: Node, model: genanki.Model, package: OpcPackage) -> List[genanki.Note]:
+  def createAnkiNotes(cls, root: Node, model: genanki.Model, allCodeBlocks: CodeBlockIndex,
+                      profiler: Profiler = NO_PROFILER, namespace: str = '') -> List[genanki.Note]:
     """
     From root Node, convert all nodes into Anki note cards
+
+    allCodeBlocks is filled by convertParagraphsToTree(), or comes from DocxToNode.getAllTables()
+    namespace goes into each note guid, so 2 documents with the same headings do not share notes, check iterDocxNotes()
+    """
+    return list(cls.iterAnkiNotes(root, model, allCodeBlocks, profiler, namespace))
+
+  @classmethod
+  def iterAnkiNotes(cls, root: Node, model: genanki.Model, allCodeBlocks: CodeBlockIndex,
+                    profiler: Profiler = NO_PROFILER, namespace: str = '') -> Iterator[genanki.Note]:
     """
-    if not root: return []
-    allCodeBlocks = DocxToNode.getAllTables(package)
-    allNotes = cls._createAnkiNotesRecursive(root, 0, [], allCodeBlocks)
-    results = []
-    for n in allNotes:
-      newNotes = genanki.Note(model=model, fields=[n.question, n.answer, n.media, n.tableOfContent], tags=n.tags)
-      results += [newNotes]
-    return results
+    Same as createAnkiNotes(), but each Anki note is created only when the loop asks for it
+    """
+    if not root: return
+    import genanki
+    for n in cls._iterMyNotes(root, allCodeBlocks, profiler, namespace):
+      profiler.count('notes')
+      yield genanki.Note(model=model, fields=[n.question, n.answer, n.media, n.tableOfContent], tags=n.tags, guid=n.guid)
 
   @classmethod
-  def _createAnkiNotesRecursive(cls, n: Node, curLevel: int, allPhotosFromParent: List[PhotoNode], allCodeBlocks: Dict[str, Table]) -> List[MyNote]:
+  def _iterMyNotes(cls, root: Node, allCodeBlocks: CodeBlockIndex,
+                   profiler: Profiler = NO_PROFILER, namespace: str = '') -> Iterator[MyNote]:
     """
-    Helper function, to create Anki note cards, from Node object, recursively
+    Helper function, to create Anki note cards, from all Node objects under root
+
+    Nodes are visited in document order, from a FlatTree, so a very deep document cannot hit the recursion limit.
+    The photos and tags of all notes are found first, in bulk passes over the FlatTree, check FlatTree.noteMedia()
+
+    Some photos ( ®®1, ®®2 ... ) are meant to be shown for all nodes in their level, and under it.
+
+    Each note's guid comes from its heading path and its position under its heading, see noteGuid().
+    Editing a line keeps the guid, so Anki updates the note. 2 headings with the same path get a count added.
+
+    @return an iterator of MyNote, root first, then children, grand-children...
+    """
+    tree = FlatTree(root)
+    media, tags, paths = tree.noteMedia(), tree.tags(), tree.headingPaths()
+    usedGuids: Dict[str, int] = {}
+    # position of each node under its parent
+    positions: Dict[int, int] = {}
+    i = 0
+    while i < len(tree):
+      n = tree.nodes[i]
+      parent = tree.parent[i]
+      position = positions.get(parent, 0)
+      positions[parent] = position + 1
+
+      note, visitChildren = cls._createAnkiNote(n, media[i], list(tags[i]), allCodeBlocks, profiler)
+      if note:
+        note.guid = noteGuid(namespace, paths[i], position)
+        if note.guid in usedGuids:
+          usedGuids[note.guid] += 1
+          note.guid = noteGuid(namespace, paths[i], position, usedGuids[note.guid])
+        else:
+          usedGuids[note.guid] = 0
+        yield note
+
+      # skip the nodes under a node that has no notes for its children
+      i = i + 1 if visitChildren else tree.end[i]
+
+  @classmethod
+  def _createAnkiNote(cls, n: Node, media: str, tags: List[str], allCodeBlocks: CodeBlockIndex,
+                      profiler: Profiler = NO_PROFILER) -> Tuple[MyNote, bool]:
+    """
+    Create the Anki note of 1 Node
 
     Parameters
     ----------
     :n:: the current node going to be handled
-    :curLevel:: keep track of what level this node current at in this tree. root=0, root.children=1...
-    :allPhotosFromParent:: some photos are meant to shown for all node in this level
-
-    @return list of all MyNote object, from this node, and all children, grand-children...
+    :media:: <img> of the node, its own ®®0 photo, or the photos from parent and grandparent... that are meant to be
+             shown for all nodes in their level
+    :tags:: tags of the node, same as n.getAllParent()
+    :profiler:: times the 'toc' and 'html' stages
 
-    This is basically a Breadth-first search algorithm
+    @return the MyNote object ( None if this node has no note ), and if the children of this node need notes too
     """
-    result = []
     # Check if it is one-off photo. It is one line of note that has a photo. it is identify with '®®0'
     if isinstance(n, PhotoNode) and n.showOnChildrenLevel == 0:
-      question, answer, tableOfContent = NodeToAnki.getAnkiNoteFields(n)
-      media = '<img src="' + n.imageName + '"><br>'
-      tags = n.getAllParent()
-      result += [MyNote(question, answer, media, tableOfContent, tags)]
-      return result
+      question, answer, tableOfContent = NodeToAnki.getAnkiNoteFields(n, profiler)
+      return MyNote(question, answer, media, tableOfContent, tags), False
     
     # Check if it is a code block, which is identify with ¨¨, follow by a 1x1 table. 
     # code is inside the table
-    if len(n.context) > 0 and '¨¨' in n.context[0].text:
-      question = NodeToAnki.unicodeToHTMLEntities(allCodeBlocks[n.context[0].text])
-      answer = NodeToAnki.unicodeToHTMLEntities(allCodeBlocks[n.context[0].text])
-      tableOfContent = NodeToAnki.unicodeToHTMLEntities(n.getBranchStr())
-      tags = n.getAllParent()
-      result += [MyNote(question, answer, '', tableOfContent, tags)]
-      return result
+    if len(n.context) > 0 and n.context[0].marker == MARKER_CODE:
+      code = allCodeBlocks.get(n.context[0].text)
+      if code is None:
+        warnings.warn("Cannot find code block : " + n.context[0].text)
+        return None, False
+      question = NodeToAnki.unicodeToHTMLEntities(code)
+      answer = question
+      tableOfContent = NodeToAnki.tableOfContentHtml(n.getBranchStr())
+      return MyNote(question, answer, '', tableOfContent, tags), False
 
     # Check if there is a multi-line single Node, which is identify using '©©' and
     # Check if node is text paragraph
     if len(n.context) > 0 and DocxToNode.isNormalParagraph(n.context[0]) \
       and '®®' not in n.context[0].text and isinstance(n.context, List):
-      question, answer, tableOfContent = NodeToAnki.getAnkiNoteFields(n)
-      tags = n.getAllParent()
-      media = ''
-      # For all photos that Parent and grandparent and up contains, add into Anki note as well
-      # , because it may have info that need for that line/note
-      for pic in allPhotosFromParent:
-        # Right after ®®, there is an integer, ®®1 means show pic on lines/notes that is same level of this tree
-        # , ®®2 shows on this level and children nodes.
-        if pic.level - curLevel < pic.showOnChildrenLevel:
-          media += '<img src="' + pic.imageName + '"><br>'
-
-      # create note
-      result += [MyNote(question, answer, media, tableOfContent, tags)]
-
-    new_all_photos_children = []
-    # Append all photos of next children level here, so children level recursive call on each text node/note/line 
-    # has all records of pic on that level.
-    for c in n.children:
-      if isinstance(c, PhotoNode) and c.showOnChildrenLevel > 0:
-        new_all_photos_children.append(c)
-
-    # recursive call each children, also appends this level pics, just in case they need to show on gran-children level
-    for c in n.children:
-      result += cls._createAnkiNotesRecursive( c, curLevel + 1, allPhotosFromParent + new_all_photos_children, allCodeBlocks)
-
-    return result
+      question, answer, tableOfContent = NodeToAnki.getAnkiNoteFields(n, profiler)
+      # media has all photos that parent and grandparent and up contains, because they may have info
+      # that is needed for this line/note
+      return MyNote(question, answer, media, tableOfContent, tags), True
+
+    return None, True
 
     
 
@@ -235,13 +416,70 @@ class MyNote:
   """
   A Data structure for Anki Note cards
   """
-  def __init__(self, question, answer, media, tableOfContent, tags):
+  def __init__(self, question, answer, media, tableOfContent, tags, guid=None):
     self.question = question
     self.answer = answer
     self.media = media
     self.tableOfContent = tableOfContent
     self.tags = tags
+    self.guid = guid
 
 
 if __name__ == "__main__":
-  docxToAnkiNotes(sys.argv[1])
+  parser = argparse.ArgumentParser(description='Convert a .docx file into an Anki .apkg file')
+  parser.add_argument('filename', help='the .docx file')
+  parser.add_argument('--cache', nargs='?', const='.docx2anki-cache', default=None, metavar='DIR',
+    help='keep the paragraphs of the document and the shrunk images between runs, an unchanged text is not read again')
+  parser.add_argument('--cache-size', type=int, default=100, metavar='MB', help='maximum size of the cache')
+  parser.add_argument('--stream', action='store_true', help='read the document paragraph by paragraph, for very big documents')
+  parser.add_argument('--shrink', action='store_true', help='resize and recompress all images, shrunk images are always cached')
+  parser.add_argument('--max-size', type=int, default=1600, metavar='PIXELS', help='with --shrink, maximum width and height of an image')
+  parser.add_argument('--format', default='webp', choices=['webp', 'jpeg', 'png'], help='with --shrink, the image format')
+  parser.add_argument('--quality', type=int, default=80, help='with --shrink, the image quality, 1 to 100')
+  parser.add_argument('--profile', nargs='?', const='-', default=None, metavar='REPORT.json',
+    help='time each stage and count paragraphs, nodes, notes and images, the JSON report goes to the file or stderr')
+  parser.add_argument('--profile-functions', type=int, default=0, metavar='N',
+    help='with --profile, also run cProfile and report the N functions with the most time')
+  parser.add_argument('--manifest', action='store_true',
+    help='also write <output>.manifest.json, with what went into the .apkg, for the next --delta run')
+  parser.add_argument('--delta', action='store_true',
+    help='only write the notes and images that are new or changed since the last --manifest or --delta run')
+  parser.add_argument('--mind-map', action='store_true', help='add a note with an .svg mind map of the whole document')
+  parser.add_argument('--watch', action='store_true', help='keep running, and convert again every time the document is saved')
+  parser.add_argument('--debounce', type=float, default=1.0, metavar='SECONDS',
+    help='with --watch, how long the document must stay unchanged before converting')
+  args = parser.parse_args()
+  if args.watch and args.delta:
+    # each rebuild replaces the .apkg, a delta not imported before the next save would be lost
+    parser.error('--delta cannot be used with --watch, use --manifest and --delta on a single run')
+
+  if args.shrink and not args.cache:
+    args.cache = '.docx2anki-cache'
+  cache = NoteCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+  shrinker = MediaShrinker(args.max_size, args.format, args.quality, cache=cache) if args.shrink else None
+  # with --watch, each rebuild has its own profiler and manifest
+  profiler = Profiler(args.profile_functions) if (args.profile or args.profile_functions) and not args.watch else NO_PROFILER
+  manifest = Manifest(args.filename + '.apkg.manifest.json') if (args.manifest or args.delta) and not args.watch else None
+  try:
+    if args.watch:
+      from watch import watchDocx
+      watchDocx(args.filename, debounce=args.debounce, cache=cache, shrinker=shrinker, manifest=args.manifest,
+                mindMap=args.mind_map, profile=args.profile or ('-' if args.profile_functions else None),
+                profileFunctions=args.profile_functions)
+    else:
+      docxToAnkiNotes(args.filename, cache=cache, stream=args.stream, shrinker=shrinker, profiler=profiler,
+                      manifest=manifest, delta=args.delta, mindMap=args.mind_map)
+      if manifest:
+        print(manifest.report())
+  finally:
+    if profiler is not NO_PROFILER:
+      if args.profile in (None, '-'):
+        print(profiler.format(), file=sys.stderr)
+      else:
+        with open(args.profile, 'w') as f:
+          f.write(profiler.format() + os.linesep)
+    if shrinker:
+      print(shrinker.report())
+    if cache:
+      cache.close()
+      print(cache.report())
@@ -1,14 +1,158 @@
 from __future__ import annotations
-from typing import List, Set
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Tuple
 import os, re
-from docx.text.paragraph import Paragraph
+
+if TYPE_CHECKING:
+  from docx.text.paragraph import Paragraph
+
+
+BLIP = '{http://schemas.openxmlformats.org/drawingml/2006/main}blip'
+IMAGEDATA = '{urn:schemas-microsoft-com:vml}imagedata'
+EMBED = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed'
+RID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+HYPERLINK = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}hyperlink'
+
+# Heading text -> Anki tag, "Heading 1: Intro" becomes heading_1_intro
+TAG_REGEX = re.compile('[^a-zA-Z0-9]+', re.I)
+
+# What the first characters of a paragraph ask for, check DocxToNode.isPicture() / lengthOfBulletList()
+MARKER_PICTURE = 'picture'
+MARKER_LIST = 'list'
+MARKER_CODE = 'code'
+PICTURE_REGEX = re.compile('®®(\\d)')
+LIST_REGEX = re.compile('©©(\\d+)')
+
+
+class StyleRecord(NamedTuple):
+  """
+  The name of a style, like python-docx ParagraphStyle.name, and what it means for the Node tree
+
+  :kind:: first word of the name in lower case, like 'heading', 'normal', 'title'
+  :level:: 1 for Heading 1, 2 for Heading 2 ..., 0 for all other styles
+  """
+  name: str
+  kind: str
+  level: int
+
+
+class RunRecord(NamedTuple):
+  """
+  Text, bold and italic of a run, like python-docx Run
+
+  bold / italic are None when the run does not set them, same as python-docx
+  """
+  text: str
+  bold: bool
+  italic: bool
+
+
+# 1 StyleRecord per style name, shared by all paragraphs
+_styleRecords: Dict[str, StyleRecord] = {}
+
+
+class ParagraphRecord(NamedTuple):
+  """
+  A read-only copy of a python-docx Paragraph, with only what a Node needs to create Anki notes.
+  It has no reference to the xml, so the docx document can be freed once the Node tree is built.
+
+  :style:: StyleRecord, same name as para.style.name
+  :text:: same as para.text, including the text inside hyperlinks
+  :runs:: same as para.runs
+  :embeds:: relationship ids of the pictures ( <a:blip r:embed="rId6"/> ) in this paragraph
+  :marker:: MARKER_PICTURE for ®®1, MARKER_LIST for ©©2, MARKER_CODE for a ¨¨ line, '' for others
+  :markerCount:: the number after ®® or ©©
+  :empty:: only spaces, tabs or new lines
+
+  marker, markerCount and empty are worked out once by create(), every later stage reads them
+  """
+  style: StyleRecord
+  text: str
+  runs: Tuple[RunRecord, ...]
+  embeds: Tuple[str, ...]
+  marker: str
+  markerCount: int
+  empty: bool
+
+  @staticmethod
+  def styleRecord(name: str) -> StyleRecord:
+    if name not in _styleRecords:
+      words = (name or '').lower().split()
+      level = int(words[1]) if len(words) > 1 and words[0] == 'heading' and words[1].isdigit() else 0
+      _styleRecords[name] = StyleRecord(name, words[0] if words else '', level)
+    return _styleRecords[name]
+
+  @classmethod
+  def create(cls, style: StyleRecord, text: str, runs: Tuple[RunRecord, ...], embeds: Tuple[str, ...]) -> ParagraphRecord:
+    """
+    Classify a paragraph from its text, check the rules on DocxToNode.isPicture() and lengthOfBulletList()
+    """
+    marker, markerCount = '', 0
+    match = PICTURE_REGEX.match(text)
+    if match:
+      marker, markerCount = MARKER_PICTURE, int(match.group(1))
+    else:
+      match = LIST_REGEX.match(text)
+      if match:
+        marker, markerCount = MARKER_LIST, int(match.group(1))
+      elif '¨¨' in text:
+        marker = MARKER_CODE
+    empty = not text.replace(' ', '').replace('\t', '').replace('\n', '')
+    return cls(style, text, runs, embeds, marker, markerCount, empty)
+
+  @classmethod
+  def fromParagraph(cls, para: Paragraph, style: StyleRecord = None) -> ParagraphRecord:
+    """
+    Copy everything needed out of a python-docx Paragraph, reading its xml only once
+
+    :style:: the style of this paragraph, if already known. Resolving para.style is slow, check DocxToNode.getStyleIndex()
+    """
+    runs = tuple(RunRecord(r.text, r.bold, r.italic) for r in para.runs)
+    embeds = []
+    # old .doc pictures converted by Word use <v:imagedata r:id="rId6"/> instead of <a:blip r:embed="rId6"/>
+    for e in para._p.iter(BLIP, IMAGEDATA):
+      rId = e.get(EMBED) or e.get(RID)
+      if rId:
+        embeds.append(rId)
+    # para.text reads every run again, it is only needed when there are hyperlinks, which are not in para.runs
+    text = para.text if para._p.find(HYPERLINK) is not None else ''.join(r.text for r in runs)
+    return cls.create(style or cls.styleRecord(para.style.name), text, runs, tuple(embeds))
+
 
 class Node:
-  def __init__(self, parent: Node, context: List[Paragraph] ):
+  """
+  A node in the tree of a document. Headings are parent nodes, other lines are children of the heading above them.
+
+  context is a list of ParagraphRecord, root has an empty list.
+  __slots__ keeps each node small, there is 1 node for every line of the document.
+
+  tocPath and tagPath are the table of content and the tags for the children of this node.
+  They are built once, when the first child is created, from the parent's tocPath and tagPath.
+  All children share them, check getBranchStr() and getAllParent()
+  """
+  __slots__ = ('context', 'parent', 'level', 'children', 'tocPath', 'tagPath')
+
+  def __init__(self, parent: Node, context: List[ParagraphRecord] ):
     self.context = context
     self.parent = parent
     self.level = 0 if parent is None else parent.level+1
     self.children = []
+    self.tocPath = None
+    self.tagPath = None
+    if parent is not None and parent.tocPath is None:
+      parent._buildPaths()
+
+  def _buildPaths(self):
+    """
+    Add this node's heading to the parent's table of content and tags
+    """
+    parentToc = self.parent.tocPath if self.parent else ''
+    parentTags = self.parent.tagPath if self.parent else ()
+    if len(self.context) > 0:
+      self.tocPath = parentToc + '- ' * self.level + self.context[0].text + os.linesep
+      self.tagPath = (TAG_REGEX.sub('_', self.context[0].text).lower(),) + parentTags
+    else:
+      self.tocPath = parentToc + 'root ' + os.linesep
+      self.tagPath = parentTags
 
   def add(self, node: Node):
     self.children.append(node)
@@ -68,14 +212,16 @@ class Node:
     return results
   
   def getAllParent(self) -> List[str]:
-    node = self
-    result = []
-    while node.parent:
-      node = node.parent
-      if len(node.context) > 0:
-        tag = re.sub('[^a-zA-Z0-9]+', '_', node.context[0].text, 0, re.I).lower()
-        result += [tag]
-    return result
+    """
+    Return the tag of each heading node, from the parent up to root Node
+
+    Example:
+    Node.getAllParent(grandChildrenNode)
+    @return ['heading2', 'heading1']
+    """
+    if not self.parent:
+      return []
+    return list(self.parent.tagPath)
 
   def getBranchStr(self) -> str:
     """
@@ -87,22 +233,18 @@ class Node:
     -Heading1\n
     --Heading2
     """
-    node = self
-    result = ''
-    while node.parent:
-      node = node.parent
-      if len(node.context) > 0:
-        result = '- ' * node.level + node.context[0].text + os.linesep + result
-      else:
-        result = 'root ' + os.linesep + result
-    return result
+    if not self.parent:
+      return ''
+    return self.parent.tocPath
 
 
 class PhotoNode(Node):
-  def __init__(self, parent: Node, image_name: str, image_index: int, show_on_children_level: int, context: List[Paragraph]):
+  __slots__ = ('imageName', 'imageRId', 'showOnChildrenLevel')
+
+  def __init__(self, parent: Node, image_name: str, image_rid: str, show_on_children_level: int, context: List[ParagraphRecord]):
     super(PhotoNode, self).__init__(parent, context)
     self.imageName = image_name
-    self.imageIndex = image_index
+    self.imageRId = image_rid
     self.showOnChildrenLevel = show_on_children_level
 
   def __repr__(self):
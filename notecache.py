@@ -0,0 +1,187 @@
+from __future__ import annotations
+import os, pickle, time
+from typing import Dict, List, Optional, Set
+
+from node import ParagraphRecord
+from codeblocks import CodeBlockIndex
+
+# a new prefix when ParagraphRecord changes, so records pickled by an older version are not read
+PARAGRAPHS_KEY = 'paragraphs1:'
+
+
+class NoteCache:
+  """
+  On-disk cache of what is slow to do again on the next run: reading the paragraphs of a document, and shrinking images
+
+  - The ParagraphRecords and code blocks of a document, keyed by the sha1 of its xml, check getParagraphs().
+    A document whose text and styles did not change is not parsed at all, even if its images changed.
+  - Shrunk images, keyed by the sha1 of the original image and the shrink options, check MediaShrinker
+
+  Everything is in 1 sqlite file inside cacheDir. Each put() is written at once, so another process can read it,
+  and a run that crashes keeps what it already stored.
+  When the cache is bigger than maxBytes, the least recently used entries are removed.
+
+  Example:
+  ```python
+  cache = NoteCache('.docx2anki-cache')
+  docxToAnkiNotes('Document.docx', cache=cache)
+  cache.close()
+  print(cache.report())
+  ```
+  """
+  def __init__(self, cacheDir: str = '.docx2anki-cache', maxBytes: int = 100 * 1024 * 1024):
+    os.makedirs(cacheDir, exist_ok=True)
+    self.maxBytes = maxBytes
+    self.hits = 0
+    self.misses = 0
+    # key -> time of the last get(), written in 1 transaction by close() or evict()
+    self.touched: Dict[str, float] = {}
+    import sqlite3
+    # autocommit, no transaction stays open between 2 statements
+    self.conn = sqlite3.connect(os.path.join(cacheDir, 'cache.sqlite'), timeout=30, isolation_level=None)
+    # readers do not wait for a writer
+    self.conn.execute('PRAGMA journal_mode=WAL')
+    self.conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+    self.conn.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+    self.totalBytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+    if self.totalBytes > self.maxBytes:
+      self.evict()
+
+  def get(self, key: str) -> Optional[bytes]:
+    row = self.conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.touched[key] = time.time()
+    return row[0]
+
+  def put(self, key: str, value: bytes):
+    old = self.conn.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+    if old:
+      self.totalBytes -= old[0]
+    self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, value, len(value), time.time()))
+    self.totalBytes += len(value)
+    if self.totalBytes > self.maxBytes:
+      self.evict()
+
+  def getParagraphs(self, key: str, codeBlocks: CodeBlockIndex) -> Optional[List[ParagraphRecord]]:
+    """
+    The ParagraphRecords stored by putParagraphs(), their code blocks are added into codeBlocks
+
+    :key:: StreamPackage.signature() of the document
+    @return None if this document is not in the cache
+    """
+    value = self.get(PARAGRAPHS_KEY + key)
+    if value is None:
+      return None
+    records, codeTexts = pickle.loads(value)
+    for text in codeTexts:
+      codeBlocks.addText(text)
+    return records
+
+  def putParagraphs(self, key: str, records: List[ParagraphRecord], codeBlocks: CodeBlockIndex):
+    self.put(PARAGRAPHS_KEY + key, pickle.dumps((records, codeBlocks.allTexts()), pickle.HIGHEST_PROTOCOL))
+
+  def _writeTouched(self):
+    if not self.touched:
+      return
+    self.conn.execute('BEGIN')
+    self.conn.executemany('UPDATE entries SET used = ? WHERE key = ?', [(used, key) for key, used in self.touched.items()])
+    self.conn.execute('COMMIT')
+    self.touched = {}
+
+  def evict(self):
+    """
+    Remove least recently used entries, until the cache fits in maxBytes
+    """
+    self._writeTouched()
+    cursor = self.conn.execute('SELECT key, size FROM entries ORDER BY used')
+    expired = []
+    for key, size in cursor:
+      if self.totalBytes <= self.maxBytes:
+        break
+      expired.append((key,))
+      self.totalBytes -= size
+    self.conn.execute('BEGIN')
+    self.conn.executemany('DELETE FROM entries WHERE key = ?', expired)
+    self.conn.execute('COMMIT')
+
+  def close(self):
+    self._writeTouched()
+    self.conn.close()
+
+  def report(self) -> str:
+    """
+    @return `Cache: 120 hits, 3 misses, 1.5 MB stored`
+    """
+    return 'Cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses, ' \
+      + '%.1f' % (self.totalBytes / 1024 / 1024) + ' MB stored'
+
+
+class MemoryNoteCache:
+  """
+  Same interface as NoteCache, kept in memory, for a process that converts the same document many times ( --watch )
+
+  Entries not used by the last conversion are dropped by sweep(), so memory stays about the size of 1 deck.
+  With a backing NoteCache, misses are looked up there, and new entries are written there too.
+
+  Example:
+  ```python
+  cache = MemoryNoteCache()
+  while True:
+    docxToAnkiNotes('Document.docx', cache=cache)
+    cache.sweep()
+  ```
+  """
+  def __init__(self, backing: NoteCache = None):
+    self.backing = backing
+    self.entries: Dict[str, bytes] = {}
+    self.used: Set[str] = set()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key: str) -> Optional[bytes]:
+    value = self.entries.get(key)
+    if value is None and self.backing:
+      value = self.backing.get(key)
+      if value is not None:
+        self.entries[key] = value
+    if value is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.used.add(key)
+    return value
+
+  def put(self, key: str, value: bytes):
+    self.entries[key] = value
+    self.used.add(key)
+    if self.backing:
+      self.backing.put(key, value)
+
+  # same as NoteCache, over get() and put() of this class
+  getParagraphs = NoteCache.getParagraphs
+  putParagraphs = NoteCache.putParagraphs
+
+  def sweep(self):
+    """
+    Forget the entries that were not used since the last sweep()
+    """
+    self.entries = {key: value for key, value in self.entries.items() if key in self.used}
+    self.used = set()
+
+  def close(self):
+    if self.backing:
+      self.backing.close()
+
+  @property
+  def totalBytes(self) -> int:
+    return sum(len(v) for v in self.entries.values())
+
+  def report(self) -> str:
+    """
+    @return `Memory cache: 120 hits, 3 misses, 1.5 MB stored`
+    """
+    return 'Memory cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses, ' \
+      + '%.1f' % (self.totalBytes / 1024 / 1024) + ' MB stored'
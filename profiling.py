@@ -0,0 +1,155 @@
+from __future__ import annotations
+import json, os, sys, time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Iterator, List
+
+try:
+  import resource
+except ImportError:
+  # not on Windows
+  resource = None
+
+
+def peakKB() -> int:
+  """
+  Peak resident memory of this process so far, in KB. None on Windows
+  """
+  if not resource:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # macOS reports bytes, Linux reports KB
+  return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class Profiler:
+  """
+  Collect stage timers and counters during 1 conversion, and optionally the hottest functions with cProfile
+
+  Stages can be nested. Time spent in a nested stage is only counted in the nested one, so
+  'notes' does not include 'html', and all the stages add up to the whole run.
+
+  Example:
+  ```python
+  profiler = Profiler(functions=20)
+  docxToAnkiNotes('Document.docx', profiler=profiler)
+  print(profiler.format())
+  ```
+  """
+  def __init__(self, functions: int = 0):
+    """
+    :functions:: how many of the hottest functions to report, 0 means no cProfile, which is much faster
+    """
+    self.functions = functions
+    self.wallSeconds: Dict[str, float] = defaultdict(float)
+    self.cpuSeconds: Dict[str, float] = defaultdict(float)
+    self.calls: Dict[str, int] = defaultdict(int)
+    self.counters: Dict[str, int] = defaultdict(int)
+    self._stack: List[str] = []
+    self._since = (0.0, 0.0)
+    self._profile = None
+    if functions:
+      # cProfile and pstats are only imported with functions
+      import cProfile
+      self._profile = cProfile.Profile()
+    self._started = None
+
+  def start(self):
+    self._started = time.perf_counter()
+    if self._profile:
+      self._profile.enable()
+
+  def stop(self):
+    if self._profile:
+      self._profile.disable()
+    self.counters['runs'] += 1
+    self.wallSeconds['total'] += time.perf_counter() - self._started
+
+  def _charge(self, now):
+    name = self._stack[-1]
+    self.wallSeconds[name] += now[0] - self._since[0]
+    self.cpuSeconds[name] += now[1] - self._since[1]
+    self._since = now
+
+  @contextmanager
+  def stage(self, name: str):
+    now = (time.perf_counter(), time.process_time())
+    if self._stack:
+      self._charge(now)
+    self._stack.append(name)
+    self._since = now
+    self.calls[name] += 1
+    try:
+      yield
+    finally:
+      self._charge((time.perf_counter(), time.process_time()))
+      self._stack.pop()
+
+  def iterate(self, name: str, items: Iterable) -> Iterator:
+    """
+    Loop over items, each next() is timed in stage name. For generators that do the work lazily
+    """
+    items = iter(items)
+    while True:
+      with self.stage(name):
+        item = next(items, StopIteration)
+      if item is StopIteration:
+        return
+      yield item
+
+  def count(self, name: str, n: int = 1):
+    self.counters[name] += n
+
+  def report(self) -> dict:
+    """
+    @return { 'stages': { name: { wallSeconds, cpuSeconds, calls } }, 'counters': {...}, 'peakKB', 'functions': [...] }
+    """
+    result = {
+      'stages': {name: {'wallSeconds': round(self.wallSeconds[name], 4), 'cpuSeconds': round(self.cpuSeconds[name], 4),
+                        'calls': self.calls[name]} for name in self.calls},
+      'totalSeconds': round(self.wallSeconds['total'], 4),
+      'counters': dict(self.counters),
+    }
+    if resource:
+      result['peakKB'] = peakKB()
+    if self._profile:
+      result['functions'] = self.hottestFunctions()
+    return result
+
+  def hottestFunctions(self) -> List[dict]:
+    """
+    The functions with the most time spent in their own code ( not in the functions they call )
+    """
+    import pstats
+    stats = pstats.Stats(self._profile).stats
+    hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:self.functions]
+    return [{'function': os.path.basename(filename) + ':' + str(line) + ' ' + function, 'calls': calls,
+             'ownSeconds': round(ownTime, 4), 'cumulativeSeconds': round(cumulativeTime, 4)}
+            for (filename, line, function), (_, calls, ownTime, cumulativeTime, _) in hottest]
+
+  def format(self) -> str:
+    return json.dumps(self.report(), indent=2)
+
+
+class NoProfiler(Profiler):
+  """
+  Used when profiling is off, every method does nothing
+  """
+  def start(self):
+    pass
+
+  def stop(self):
+    pass
+
+  def stage(self, name: str):
+    return _NULL_STAGE
+
+  def iterate(self, name: str, items: Iterable) -> Iterator:
+    return iter(items)
+
+  def count(self, name: str, n: int = 1):
+    pass
+
+
+_NULL_STAGE = nullcontext()
+NO_PROFILER = NoProfiler()
@@ -0,0 +1,282 @@
+from __future__ import annotations
+import argparse, hashlib, json, os, threading, time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from manifest import uploadName
+
+
+def _warmUp():
+  """
+  Worker process start: import docx, genanki and PIL once, so the first upload does not pay for it.
+  myanki alone imports none of them, they are imported by the stage that needs them
+  """
+  import docx.package, genanki, PIL.Image
+  import myanki, ankimodel, apkgwriter
+
+
+def _convert(docx: bytes, name: str, stream: bool, shrink: bool):
+  """
+  Worker: 1 conversion, with its own shrinker so nothing is shared between jobs
+  """
+  from myanki import docxToApkgBytes
+  from imageshrink import MediaShrinker
+  shrinker = MediaShrinker(workers=1) if shrink else None
+  return docxToApkgBytes(docx, name, stream=stream, shrinker=shrinker)
+
+
+class ServiceBusy(Exception):
+  """
+  Raised by ConversionService.submit() when maxQueue jobs are already waiting or running
+  """
+
+
+class ConversionService:
+  """
+  Convert uploaded .docx files with a pool of warm worker processes, behind a bounded job queue and a result cache
+
+  - Workers are started and import everything before the first job, check _warmUp()
+  - At most maxQueue jobs are waiting or running, more are refused with ServiceBusy
+  - When a worker process dies ( out of memory, crash in a library ), the pool cannot run any more jobs,
+    so a new pool is started. The jobs of the old pool fail with BrokenProcessPool
+  - Results are cached by the sha1 of the upload and the options, the least recently used are dropped
+    after cacheBytes. The same upload sent again while it is still converting waits for the same job.
+
+  Example:
+  ```python
+  service = ConversionService(workers=4)
+  future, cache = service.submit(docxBytes, 'Document.docx')
+  future.result().apkg
+  service.close()
+  ```
+  """
+  def __init__(self, workers: int = None, maxQueue: int = 16, cacheBytes: int = 200 * 1024 * 1024, latencies: int = 1000):
+    self.maxQueue = maxQueue
+    self.cacheBytes = cacheBytes
+    self.workers = workers or os.cpu_count() or 1
+    self.pool = self._newPool()
+    # start all the workers now, instead of on the first uploads
+    for f in [self.pool.submit(time.sleep, 0) for _ in range(self.workers)]:
+      f.result()
+
+    self._lock = threading.Lock()
+    self._cache: OrderedDict[str, object] = OrderedDict()
+    self._cacheSize = 0
+    self._running: Dict[str, Future] = {}
+    self.started = time.time()
+    self.counters = {'requests': 0, 'converted': 0, 'failed': 0, 'cancelled': 0, 'busy': 0, 'cacheHits': 0, 'joined': 0,
+                     'poolRestarts': 0}
+    # ( finish time, seconds ) of the last requests
+    self._latencies = deque(maxlen=latencies)
+
+  def _newPool(self) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=self.workers, initializer=_warmUp)
+
+  def _restartPool(self, broken: ProcessPoolExecutor):
+    """
+    Replace a broken pool, once: the jobs of a broken pool all fail, and each one asks for a restart. Needs _lock
+    """
+    if broken is not self.pool:
+      return
+    self.counters['poolRestarts'] += 1
+    self.pool = self._newPool()
+    broken.shutdown(wait=False, cancel_futures=True)
+
+  @staticmethod
+  def jobKey(docx: bytes, name: str, stream: bool, shrink: bool) -> str:
+    h = hashlib.sha1(docx)
+    h.update(json.dumps([name, stream, shrink]).encode('utf-8'))
+    return h.hexdigest()
+
+  def submit(self, docx: bytes, name: str = None, stream: bool = False, shrink: bool = False) -> Tuple[Future, str]:
+    """
+    Without a name, the deck name comes from the sha1 of the upload, so the decks of 2 anonymous uploads
+    never overwrite each other's notes in Anki, check uploadName()
+
+    @return a Future of the ConversionResult, and 'hit', 'joined' or 'miss' for the cache
+    """
+    name = name or uploadName(docx)
+    key = self.jobKey(docx, name, stream, shrink)
+    with self._lock:
+      self.counters['requests'] += 1
+      if key in self._cache:
+        self._cache.move_to_end(key)
+        self.counters['cacheHits'] += 1
+        future = Future()
+        future.set_result(self._cache[key])
+        return future, 'hit'
+      if key in self._running:
+        self.counters['joined'] += 1
+        return self._running[key], 'joined'
+      if len(self._running) >= self.maxQueue:
+        self.counters['busy'] += 1
+        raise ServiceBusy('%d jobs already queued' % len(self._running))
+      pool = self.pool
+      try:
+        future = pool.submit(_convert, docx, name, stream, shrink)
+      except BrokenProcessPool:
+        # a worker died since the last job, try once more with a new pool
+        self._restartPool(pool)
+        pool = self.pool
+        future = pool.submit(_convert, docx, name, stream, shrink)
+      self._running[key] = future
+    future.add_done_callback(lambda f: self._done(key, f, pool))
+    return future, 'miss'
+
+  def _done(self, key: str, future: Future, pool: ProcessPoolExecutor):
+    with self._lock:
+      del self._running[key]
+      if future.cancelled():
+        # close() cancels the waiting jobs
+        self.counters['cancelled'] += 1
+        return
+      if future.exception() is not None:
+        self.counters['failed'] += 1
+        if isinstance(future.exception(), BrokenProcessPool):
+          self._restartPool(pool)
+        return
+      self.counters['converted'] += 1
+      result = future.result()
+      self._cache[key] = result
+      self._cacheSize += len(result.apkg)
+      while self._cacheSize > self.cacheBytes and self._cache:
+        _, old = self._cache.popitem(last=False)
+        self._cacheSize -= len(old.apkg)
+
+  def recordLatency(self, seconds: float):
+    with self._lock:
+      self._latencies.append((time.time(), seconds))
+
+  def metrics(self, window: float = 60.0) -> dict:
+    """
+    Counters, queue, cache, latency percentiles of the last requests, and throughput over the last window seconds
+    """
+    with self._lock:
+      latencies = list(self._latencies)
+      result = {
+        'uptimeSeconds': round(time.time() - self.started, 1),
+        'workers': self.workers,
+        'queued': len(self._running),
+        'maxQueue': self.maxQueue,
+        'cacheEntries': len(self._cache),
+        'cacheBytes': self._cacheSize,
+        'counters': dict(self.counters),
+      }
+    seconds = sorted(s for _, s in latencies)
+    result['latencyMs'] = {name: round(_percentile(seconds, p) * 1000, 1) for name, p in (('p50', 50), ('p90', 90), ('p99', 99))}
+    result['latencyMs']['samples'] = len(seconds)
+    since = time.time() - window
+    result['requestsPerSecond'] = round(sum(1 for t, _ in latencies if t >= since) / window, 3)
+    return result
+
+  def close(self):
+    with self._lock:
+      pool = self.pool
+    pool.shutdown(cancel_futures=True)
+
+
+def _percentile(sortedValues, percent: float) -> float:
+  if not sortedValues:
+    return 0.0
+  return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percent / 100))]
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+  """
+  POST /convert?name=Document.docx&stream=1&shrink=1 with the .docx as body -> the .apkg
+  GET /metrics -> JSON from ConversionService.metrics()
+  """
+  service: ConversionService = None
+  maxUploadBytes = 100 * 1024 * 1024
+  # seconds a request waits for its conversion
+  jobTimeout = 600
+
+  def do_GET(self):
+    path = urlparse(self.path).path
+    if path == '/metrics':
+      self._send(200, json.dumps(self.service.metrics(), indent=2).encode('utf-8'), 'application/json')
+    elif path == '/health':
+      self._send(200, b'ok\n', 'text/plain')
+    else:
+      self._send(404, b'not found\n', 'text/plain')
+
+  def do_POST(self):
+    url = urlparse(self.path)
+    if url.path != '/convert':
+      return self._send(404, b'not found\n', 'text/plain')
+    length = int(self.headers.get('Content-Length') or 0)
+    if length <= 0 or length > self.maxUploadBytes:
+      return self._send(413, b'send the .docx as the request body, at most %d bytes\n' % self.maxUploadBytes, 'text/plain')
+    start = time.perf_counter()
+    docx = self.rfile.read(length)
+    query = parse_qs(url.query)
+    name = query.get('name', [None])[0]
+    stream = query.get('stream', ['0'])[0] == '1'
+    shrink = query.get('shrink', ['0'])[0] == '1'
+
+    try:
+      future, cache = self.service.submit(docx, name, stream, shrink)
+    except ServiceBusy as e:
+      return self._send(503, (str(e) + ', try again later\n').encode('utf-8'), 'text/plain', {'Retry-After': '5'})
+    except BrokenProcessPool:
+      return self._send(503, b'the workers are restarting, try again later\n', 'text/plain', {'Retry-After': '5'})
+    try:
+      result = future.result(timeout=self.jobTimeout)
+    except TimeoutError:
+      # the job keeps running, and its result is cached when it is done
+      self.service.recordLatency(time.perf_counter() - start)
+      return self._send(504, b'the conversion takes more than %d seconds\n' % self.jobTimeout, 'text/plain')
+    except BrokenProcessPool:
+      self.service.recordLatency(time.perf_counter() - start)
+      return self._send(500, b'the worker process died during the conversion, try again\n', 'text/plain')
+    except Exception as e:
+      self.service.recordLatency(time.perf_counter() - start)
+      return self._send(422, ('Cannot convert %s, %s: %s\n' % (name or 'upload', type(e).__name__, e)).encode('utf-8'), 'text/plain')
+    self.service.recordLatency(time.perf_counter() - start)
+    self._send(200, result.apkg, 'application/octet-stream', {
+      'Content-Disposition': 'attachment; filename="%s.apkg"' % result.name.replace('"', ''),
+      'X-Cache': cache,
+      'X-Notes': str(result.stats['counters'].get('notes', 0)),
+    })
+
+  def _send(self, status: int, body: bytes, contentType: str, headers: dict = None):
+    self.send_response(status)
+    self.send_header('Content-Type', contentType)
+    self.send_header('Content-Length', str(len(body)))
+    for key, value in (headers or {}).items():
+      self.send_header(key, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def serve(host: str = '127.0.0.1', port: int = 8765, service: ConversionService = None) -> ThreadingHTTPServer:
+  """
+  @return the http server, call serve_forever() on it
+  """
+  handler = type('Handler', (ConversionHandler,), {'service': service or ConversionService()})
+  return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Local http service that converts uploaded .docx files into .apkg files')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8765)
+  parser.add_argument('--workers', type=int, default=None, help='worker processes, default is number of CPUs')
+  parser.add_argument('--max-queue', type=int, default=16, help='jobs waiting or running, more get 503 busy')
+  parser.add_argument('--cache-size', type=int, default=200, metavar='MB', help='memory for the converted .apkg files')
+  args = parser.parse_args()
+
+  service = ConversionService(args.workers, args.max_queue, args.cache_size * 1024 * 1024)
+  server = serve(args.host, args.port, service)
+  print('Listening on http://%s:%d  ( POST /convert?name=Document.docx, GET /metrics )' % (args.host, args.port), flush=True)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    service.close()
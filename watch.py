@@ -0,0 +1,114 @@
+from __future__ import annotations
+import os, sys, time, traceback
+from typing import Tuple
+
+from myanki import docxToAnkiNotes
+from docxstream import ParagraphMemo
+from notecache import NoteCache, MemoryNoteCache
+from imageshrink import MediaShrinker
+from manifest import Manifest
+from profiling import Profiler
+
+
+def fileSignature(filename: str) -> Tuple[int, int]:
+  """
+  @return ( modified time in ns, size ), or None while the file is missing ( Word replaces the file when saving )
+  """
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return None
+  return st.st_mtime_ns, st.st_size
+
+
+def _log(*args):
+  print(time.strftime('%H:%M:%S'), *args, flush=True)
+
+
+def watchDocx(filename: str, outputFilename: str = None, interval: float = 0.5, debounce: float = 1.0,
+              cache: NoteCache = None, shrinker: MediaShrinker = None, once: bool = False,
+              manifest: bool = False, mindMap: bool = False, profile: str = None, profileFunctions: int = 0):
+  """
+  Convert a .docx file into a .apkg file, then again every time the .docx is saved, until Ctrl+C
+
+  The file is polled every interval seconds. After a change, it must stay the same for debounce seconds before
+  the rebuild starts, so a save that writes the file in many steps only causes 1 rebuild.
+
+  The paragraphs stay in a ParagraphMemo between rebuilds, a paragraph whose xml did not change is not converted again.
+  The document is always read with StreamPackage, like --stream.
+  Shrunk images stay in a MemoryNoteCache, only changed images are shrunk again. With a cache, it is used behind the memory one.
+
+  The new .apkg is written next to the old one, then renamed, so Anki never reads a half written file.
+
+  :once:: stop after the first rebuild, for scripts
+  :manifest:: write <output>.manifest.json after each rebuild, same as docxToAnkiNotes()
+  :mindMap:: add the mind map note, same as docxToAnkiNotes()
+  :profile:: write the profiler report of each rebuild into this file, or to stderr for '-'
+  :profileFunctions:: with profile, also run cProfile and report the N functions with the most time
+  """
+  outputFilename = outputFilename or filename + '.apkg'
+  memo = ParagraphMemo()
+  memoryCache = MemoryNoteCache(cache)
+  if shrinker:
+    shrinker.cache = memoryCache
+
+  _log('Watching', filename, '-> ' + outputFilename, '( Ctrl+C to stop )')
+  built = None
+  try:
+    while True:
+      signature = fileSignature(filename)
+      if signature is None or signature == built:
+        time.sleep(interval)
+        continue
+
+      # wait until the file stops changing
+      stableSince = time.monotonic()
+      while time.monotonic() - stableSince < debounce:
+        time.sleep(min(interval, debounce))
+        newSignature = fileSignature(filename)
+        if newSignature != signature:
+          signature, stableSince = newSignature, time.monotonic()
+      if signature is None:
+        continue
+
+      built = signature
+      if rebuild(filename, outputFilename, memo, memoryCache, shrinker, manifest, mindMap, profile, profileFunctions) and once:
+        return
+  except KeyboardInterrupt:
+    _log('Stopped')
+
+
+def rebuild(filename: str, outputFilename: str, memo: ParagraphMemo, memoryCache: MemoryNoteCache,
+            shrinker: MediaShrinker = None, manifest: bool = False, mindMap: bool = False, profile: str = None,
+            profileFunctions: int = 0) -> bool:
+  """
+  1 rebuild of the watch loop, logs how long it took, check watchDocx() for the arguments
+
+  @return False if the document cannot be converted, like a half saved file. The old .apkg and manifest are kept
+  """
+  hits, misses = memo.hits, memo.misses
+  profiler = Profiler(profileFunctions)
+  temporary = outputFilename + '.tmp'
+  # loaded again each time, the notes of a failed rebuild must not stay in it
+  runManifest = Manifest(outputFilename + '.manifest.json') if manifest else None
+  try:
+    docxToAnkiNotes(filename, temporary, shrinker=shrinker, profiler=profiler, manifest=runManifest, mindMap=mindMap, memo=memo)
+    os.replace(temporary, outputFilename)
+  except Exception:
+    _log('Cannot convert', filename, '( still being saved? )', traceback.format_exc(limit=1).strip().splitlines()[-1])
+    if os.path.exists(temporary):
+      os.remove(temporary)
+    return False
+  memo.sweep()
+  memoryCache.sweep()
+
+  report = profiler.report()
+  _log('Rebuilt', outputFilename, 'in %.0f ms,' % (report['totalSeconds'] * 1000),
+       report['counters'].get('notes', 0), 'notes,', report['counters'].get('images', 0), 'images,',
+       memo.hits - hits, 'paragraphs reused,', memo.misses - misses, 'read')
+  if profile == '-':
+    print(profiler.format(), file=sys.stderr)
+  elif profile:
+    with open(profile, 'w') as f:
+      f.write(profiler.format() + os.linesep)
+  return True